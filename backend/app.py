@@ -1,44 +1,220 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import sqlite3
+from werkzeug.http import http_date
+import base64
+import csv
+import datetime
+import hashlib
+import io
+import json
 import os
 
+from db import Database
+import metricas
+
 app = Flask(__name__)
 CORS(app)
+metricas.instrumentar_flask(app, 'riegos')
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, 'lotes.db')
+DB_PATH = os.environ.get('RIEGOS_DB_PATH', os.path.join(BASE_DIR, 'lotes.db'))
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+EXPORT_BATCH_SIZE = 1000
+RIEGO_FIELDS = ['id', 'lote', 'fecha', 'nota']
+# Below this zoom level /api/lotes groups lots into grid clusters of about CLUSTER_CELL_PX pixels.
+CLUSTER_MAX_ZOOM = 13
+CLUSTER_CELL_PX = 60
+
+db = Database(DB_PATH)
 
 
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db.connection()
 
 
 def init_db():
-    conn = get_db()
-    conn.execute(
+    get_db().executescript(
         """
         CREATE TABLE IF NOT EXISTS riegos (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             lote TEXT NOT NULL,
             fecha TEXT NOT NULL,
-            nota TEXT DEFAULT ''
-        )
+            nota TEXT DEFAULT '',
+            lat REAL,
+            lng REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_riegos_fecha_id ON riegos (fecha, id);
+        CREATE INDEX IF NOT EXISTS idx_riegos_lote_fecha_id ON riegos (lote, fecha, id);
+        CREATE TABLE IF NOT EXISTS riegos_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            modificado TEXT NOT NULL
+        );
+        INSERT OR IGNORE INTO riegos_version (id, version, modificado) VALUES (1, 0, datetime('now'));
+        CREATE TRIGGER IF NOT EXISTS riegos_ai AFTER INSERT ON riegos BEGIN
+            UPDATE riegos_version SET version = version + 1, modificado = datetime('now') WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS riegos_au AFTER UPDATE ON riegos BEGIN
+            UPDATE riegos_version SET version = version + 1, modificado = datetime('now') WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS riegos_ad AFTER DELETE ON riegos BEGIN
+            UPDATE riegos_version SET version = version + 1, modificado = datetime('now') WHERE id = 1;
+        END;
+        -- One row per distinct lot with coordinates, indexed with an R*Tree for viewport queries.
+        CREATE TABLE IF NOT EXISTS lotes (
+            id INTEGER PRIMARY KEY,
+            lote TEXT NOT NULL UNIQUE,
+            lat REAL NOT NULL,
+            lng REAL NOT NULL
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS lotes_rtree USING rtree (id, min_lat, max_lat, min_lng, max_lng);
+        CREATE TRIGGER IF NOT EXISTS lotes_ai AFTER INSERT ON lotes BEGIN
+            INSERT INTO lotes_rtree VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lng, NEW.lng);
+        END;
+        CREATE TRIGGER IF NOT EXISTS lotes_ad AFTER DELETE ON lotes BEGIN
+            DELETE FROM lotes_rtree WHERE id = OLD.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS riegos_lotes_ai AFTER INSERT ON riegos WHEN NEW.lat IS NOT NULL BEGIN
+            INSERT OR IGNORE INTO lotes (lote, lat, lng) VALUES (NEW.lote, NEW.lat, NEW.lng);
+        END;
+        CREATE TRIGGER IF NOT EXISTS riegos_lotes_au AFTER UPDATE OF lote, lat, lng ON riegos BEGIN
+            DELETE FROM lotes WHERE lote = OLD.lote AND NOT EXISTS (SELECT 1 FROM riegos WHERE lote = OLD.lote);
+            INSERT OR IGNORE INTO lotes (lote, lat, lng) SELECT NEW.lote, NEW.lat, NEW.lng WHERE NEW.lat IS NOT NULL;
+        END;
+        CREATE TRIGGER IF NOT EXISTS riegos_lotes_ad AFTER DELETE ON riegos BEGIN
+            DELETE FROM lotes WHERE lote = OLD.lote AND NOT EXISTS (SELECT 1 FROM riegos WHERE lote = OLD.lote);
+        END;
         """
     )
-    conn.commit()
-    conn.close()
+    add_coordinate_columns()
+
+
+def add_coordinate_columns():
+    # Databases created before lat/lng existed: add the columns and fill them from lote.
+    conn = get_db()
+    if 'lat' in {row['name'] for row in conn.execute('PRAGMA table_info(riegos)')}:
+        return
+    with db.transaction() as conn:
+        conn.execute('ALTER TABLE riegos ADD COLUMN lat REAL')
+        conn.execute('ALTER TABLE riegos ADD COLUMN lng REAL')
+        rows = [(*parse_lote(row['lote']), row['id']) for row in conn.execute('SELECT id, lote FROM riegos')]
+        conn.executemany('UPDATE riegos SET lat = ?, lng = ? WHERE id = ?', [row for row in rows if row[0] is not None])
+
+
+def parse_lote(lote):
+    # Lots picked on the map are stored as "lat,lng"; anything else is free text without coordinates.
+    try:
+        lat, lng = (float(part) for part in str(lote).split(','))
+    except ValueError:
+        return None, None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None, None
+    return lat, lng
+
+
+def encode_cursor(fecha, riego_id):
+    return base64.urlsafe_b64encode(f'{fecha}|{riego_id}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    fecha, riego_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+    return fecha, int(riego_id)
+
+
+def build_filters(args):
+    where, params = [], []
+    if args.get('lote'):
+        where.append('lote = ?')
+        params.append(args['lote'])
+    if args.get('desde'):
+        where.append('fecha >= ?')
+        params.append(args['desde'])
+    if args.get('hasta'):
+        where.append('fecha <= ?')
+        params.append(args['hasta'])
+    return where, params
+
+
+def parse_bbox(value):
+    min_lng, min_lat, max_lng, max_lat = (float(part) for part in value.split(','))
+    if min_lng > max_lng or min_lat > max_lat:
+        raise ValueError('bbox must be min_lng,min_lat,max_lng,max_lat')
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def parse_fecha(value):
+    # date.fromisoformat also takes 20240101 or 2024-W01-1 on Python 3.11+; fechas are compared as text,
+    # so only YYYY-MM-DD is accepted and it is stored zero-padded.
+    return datetime.datetime.strptime(str(value), '%Y-%m-%d').date().isoformat()
+
+
+def validate_riego(data):
+    if not isinstance(data, dict):
+        return 'row must be an object'
+    if not data.get('lote') or not data.get('fecha'):
+        return 'lote and fecha required'
+    try:
+        parse_fecha(data['fecha'])
+    except ValueError:
+        return 'fecha must be YYYY-MM-DD'
+    return None
+
+
+def iter_bulk_rows():
+    # Yields (row, parse_error) so malformed lines are reported instead of aborting the batch.
+    if request.mimetype == 'text/csv':
+        yield from ((row, None) for row in csv.DictReader(io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')))
+    elif request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+        for line in io.TextIOWrapper(request.stream, encoding='utf-8'):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line), None
+            except ValueError as e:
+                yield None, f'invalid JSON: {e}'
+    else:
+        data = request.get_json(force=True)
+        if not isinstance(data, list):
+            raise ValueError('expected a JSON array')
+        yield from ((row, None) for row in data)
 
 
 @app.route('/api/riegos', methods=['GET'])
 def list_riegos():
+    cursor = request.args.get('cursor')
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        after = decode_cursor(cursor) if cursor else None
+    except (ValueError, UnicodeDecodeError):
+        return jsonify({'error': 'invalid limit or cursor'}), 400
+
     conn = get_db()
-    rows = conn.execute('SELECT id, lote, fecha, nota FROM riegos').fetchall()
-    conn.close()
-    riegos = [dict(row) for row in rows]
-    return jsonify(riegos)
+    version, modificado = conn.execute('SELECT version, modificado FROM riegos_version WHERE id = 1').fetchone()
+    last_modified = datetime.datetime.fromisoformat(modificado).replace(tzinfo=datetime.timezone.utc)
+    etag = f'{version}-{hashlib.sha1(request.query_string).hexdigest()[:16]}'
+    if request.if_none_match.contains_weak(etag) or (
+        not request.if_none_match and request.if_modified_since and request.if_modified_since >= last_modified
+    ):
+        response = app.response_class(status=304)
+    else:
+        where, params = build_filters(request.args)
+        if after:
+            where.append('(fecha, id) < (?, ?)')
+            params.extend(after)
+        sql = 'SELECT id, lote, fecha, nota FROM riegos'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY fecha DESC, id DESC LIMIT ?'
+        rows = conn.execute(sql, params + [limit + 1]).fetchall()
+        riegos = [dict(row) for row in rows[:limit]]
+        next_cursor = encode_cursor(riegos[-1]['fecha'], riegos[-1]['id']) if len(rows) > limit else None
+        response = jsonify({'riegos': riegos, 'next_cursor': next_cursor})
+    response.set_etag(etag, weak=True)
+    response.headers['Last-Modified'] = http_date(last_modified)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @app.route('/api/riegos', methods=['POST'])
@@ -49,14 +225,106 @@ def create_riego():
     nota = data.get('nota', '')
     if not lote or not fecha:
         return jsonify({'error': 'lote and fecha required'}), 400
-    conn = get_db()
-    cur = conn.execute('INSERT INTO riegos (lote, fecha, nota) VALUES (?, ?, ?)', (lote, fecha, nota))
-    conn.commit()
-    new_id = cur.lastrowid
-    conn.close()
+    with db.transaction() as conn:
+        new_id = conn.execute(
+            'INSERT INTO riegos (lote, fecha, nota, lat, lng) VALUES (?, ?, ?, ?, ?)', (lote, fecha, nota, *parse_lote(lote))
+        ).lastrowid
     return jsonify({'id': new_id, 'lote': lote, 'fecha': fecha, 'nota': nota}), 201
 
 
+@app.route('/api/riegos/bulk', methods=['POST'])
+def bulk_create_riegos():
+    rows, errors = [], []
+    try:
+        for index, (data, error) in enumerate(iter_bulk_rows()):
+            error = error or validate_riego(data)
+            if error:
+                errors.append({'row': index, 'error': error})
+            else:
+                rows.append((data['lote'], parse_fecha(data['fecha']), data.get('nota') or '', *parse_lote(data['lote'])))
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'error': str(e)}), 400
+    # Parse the whole body first so the write lock is not held while a slow upload arrives.
+    if rows:
+        with db.transaction() as conn:
+            conn.executemany('INSERT INTO riegos (lote, fecha, nota, lat, lng) VALUES (?, ?, ?, ?, ?)', rows)
+    return jsonify({'inserted': len(rows), 'errors': errors}), 201 if rows else 400
+
+
+@app.route('/api/riegos/export', methods=['GET'])
+def export_riegos():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    where, params = build_filters(request.args)
+    sql = 'SELECT id, lote, fecha, nota FROM riegos'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY fecha, id'
+
+    def generate():
+        # Own connection: the generator outlives the view and iterates the cursor batch by batch.
+        conn = db.connect()
+        try:
+            cur = conn.execute(sql, params)
+            if fmt == 'csv':
+                yield ','.join(RIEGO_FIELDS) + '\r\n'
+            while True:
+                batch = cur.fetchmany(EXPORT_BATCH_SIZE)
+                if not batch:
+                    break
+                if fmt == 'csv':
+                    buffer = io.StringIO()
+                    csv.writer(buffer).writerows(tuple(row) for row in batch)
+                    yield buffer.getvalue()
+                else:
+                    yield ''.join(json.dumps(dict(row), ensure_ascii=False) + '\n' for row in batch)
+        finally:
+            conn.close()
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return app.response_class(generate(), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=riegos.{fmt}',
+    })
+
+
+@app.route('/api/lotes', methods=['GET'])
+def list_lotes():
+    # Lots inside the bbox with their latest irrigation and the number of irrigations between desde and hasta.
+    # Below CLUSTER_MAX_ZOOM lots are grouped on a grid so the map never receives thousands of markers.
+    try:
+        min_lng, min_lat, max_lng, max_lat = parse_bbox(request.args.get('bbox', ''))
+        zoom = int(request.args.get('zoom', CLUSTER_MAX_ZOOM))
+    except ValueError:
+        return jsonify({'error': 'bbox=min_lng,min_lat,max_lng,max_lat and an integer zoom required'}), 400
+    window, params = [], []
+    if request.args.get('desde'):
+        window.append('r.fecha >= ?')
+        params.append(request.args['desde'])
+    if request.args.get('hasta'):
+        window.append('r.fecha <= ?')
+        params.append(request.args['hasta'])
+    in_view = f"""
+        SELECT l.lote, l.lat, l.lng,
+               (SELECT max(r.fecha) FROM riegos r WHERE r.lote = l.lote) AS ultimo_riego,
+               (SELECT count(*) FROM riegos r WHERE {' AND '.join(['r.lote = l.lote'] + window)}) AS riegos
+        FROM lotes_rtree t JOIN lotes l ON l.id = t.id
+        WHERE t.max_lat >= ? AND t.min_lat <= ? AND t.max_lng >= ? AND t.min_lng <= ?
+    """
+    params += [min_lat, max_lat, min_lng, max_lng]
+    conn = get_db()
+    if zoom >= CLUSTER_MAX_ZOOM:
+        return jsonify({'lotes': [dict(row) for row in conn.execute(in_view, params)], 'clusters': []})
+    # Cells are anchored at (-180, -90) so clusters do not jump around while panning.
+    cell = 360 / (256 * 2 ** max(zoom, 0)) * CLUSTER_CELL_PX
+    rows = conn.execute(f"""
+        SELECT count(*) AS lotes, avg(lat) AS lat, avg(lng) AS lng, sum(riegos) AS riegos, max(ultimo_riego) AS ultimo_riego
+        FROM ({in_view})
+        GROUP BY CAST((lng + 180) / ? AS INTEGER), CAST((lat + 90) / ? AS INTEGER)
+    """, params + [cell, cell])
+    return jsonify({'lotes': [], 'clusters': [dict(row) for row in rows]})
+
+
 @app.route('/api/riegos/<int:riego_id>', methods=['PUT'])
 def update_riego(riego_id):
     data = request.get_json(force=True)
@@ -65,22 +333,19 @@ def update_riego(riego_id):
     nota = data.get('nota', '')
     if not lote or not fecha:
         return jsonify({'error': 'lote and fecha required'}), 400
-    conn = get_db()
-    conn.execute('UPDATE riegos SET lote=?, fecha=?, nota=? WHERE id=?', (lote, fecha, nota, riego_id))
-    conn.commit()
-    conn.close()
+    with db.transaction() as conn:
+        conn.execute('UPDATE riegos SET lote=?, fecha=?, nota=?, lat=?, lng=? WHERE id=?', (lote, fecha, nota, *parse_lote(lote), riego_id))
     return jsonify({'id': riego_id, 'lote': lote, 'fecha': fecha, 'nota': nota})
 
 
 @app.route('/api/riegos/<int:riego_id>', methods=['DELETE'])
 def delete_riego(riego_id):
-    conn = get_db()
-    conn.execute('DELETE FROM riegos WHERE id=?', (riego_id,))
-    conn.commit()
-    conn.close()
+    with db.transaction() as conn:
+        conn.execute('DELETE FROM riegos WHERE id=?', (riego_id,))
     return jsonify({'status': 'deleted'})
 
 
+init_db()
+
 if __name__ == '__main__':
-    init_db()
     app.run(debug=True)
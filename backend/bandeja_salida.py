@@ -0,0 +1,187 @@
+import datetime
+import json
+import threading
+import time
+import uuid
+
+import requests
+
+import espejo_odk
+from odk_cliente import ClienteODK, xml_envio
+
+ESPERA_MAXIMA = 300
+ESPERA_INICIAL = 2
+# Un 'enviando' más viejo que esto quedó colgado (proceso reiniciado) y se reintenta.
+ENVIO_COLGADO = 600
+VENTANA_AVISOS = datetime.timedelta(minutes=30)
+
+
+def _ahora_iso():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class BandejaSalida:
+    # Cola persistente de altas, ediciones y bajas hacia ODK Central. Cada cambio se aplica
+    # primero al espejo local (la matriz lo ve enseguida) y un hilo de fondo lo envía con reintentos.
+
+    def __init__(self, base_url, form_id):
+        self.base_url = base_url
+        self.form_id = form_id
+        # usuario -> token: cada operación sale con el token de la sesión que la encoló.
+        self._tokens = {}
+        self._condicion = threading.Condition()
+        self._hilo = None
+
+    def registrar_token(self, usuario, token):
+        with self._condicion:
+            if self._tokens.get(usuario) != token:
+                self._tokens[usuario] = token
+                self._condicion.notify()
+        self._iniciar()
+
+    def _iniciar(self):
+        with self._condicion:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ciclo, name='bandeja-salida', daemon=True)
+                self._hilo.start()
+
+    def encolar(self, operacion, instance_id=None, datos=None, version_formulario=None, usuario=None):
+        # usuario identifica la sesión que encoló el cambio: solo a ella se le muestran sus avisos.
+        espejo_odk.init_db()
+        conn = espejo_odk.get_db()
+        try:
+            nuevo_instance_id, deprecated_id = None, None
+            if operacion == 'crear':
+                instance_id = f"uuid:{uuid.uuid4()}"
+            elif operacion == 'editar':
+                nuevo_instance_id = f"uuid:{uuid.uuid4()}"
+                deprecated_id = espejo_odk.instance_id_actual(conn, instance_id)
+            ahora = _ahora_iso()
+            cur = conn.execute(
+                'INSERT INTO bandeja_salida (operacion, instance_id, nuevo_instance_id, deprecated_id, datos, '
+                'version_formulario, creado, actualizado, usuario) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (operacion, instance_id, nuevo_instance_id, deprecated_id, json.dumps(datos) if datos else None,
+                 version_formulario, ahora, ahora, usuario),
+            )
+            espejo_odk.aplicar_cambio_local(conn, operacion, instance_id, datos, nuevo_instance_id)
+            conn.commit()
+            id_operacion = cur.lastrowid
+        finally:
+            conn.close()
+        with self._condicion:
+            self._condicion.notify()
+        self._iniciar()
+        return id_operacion
+
+    def resumen(self, usuario):
+        # Pendientes y avisos de los cambios que encoló este usuario.
+        espejo_odk.init_db()
+        conn = espejo_odk.get_db()
+        try:
+            pendientes = conn.execute(
+                "SELECT COUNT(*) FROM bandeja_salida WHERE usuario = ? AND estado IN ('pendiente', 'enviando')", (usuario,)
+            ).fetchone()[0]
+            desde = (datetime.datetime.now(datetime.timezone.utc) - VENTANA_AVISOS).isoformat()
+            avisos = [dict(row) for row in conn.execute(
+                "SELECT id, operacion, estado, ultimo_error, json_extract(datos, '$.empleado') AS empleado, "
+                "json_extract(datos, '$.fecha') AS fecha FROM bandeja_salida "
+                "WHERE usuario = ? AND estado IN ('conflicto', 'error') AND actualizado >= ? ORDER BY id", (usuario, desde)
+            )]
+        finally:
+            conn.close()
+        return {'pendientes': pendientes, 'avisos': avisos}
+
+    def _ciclo(self):
+        while True:
+            try:
+                procesada = self.procesar_siguiente()
+            except Exception:
+                procesada = False
+            if not procesada:
+                with self._condicion:
+                    self._condicion.wait(timeout=ESPERA_INICIAL)
+
+    def _tomar_siguiente(self, conn, usuarios):
+        limite_colgado = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=ENVIO_COLGADO)).isoformat()
+        conn.execute("UPDATE bandeja_salida SET estado='pendiente' WHERE estado='enviando' AND actualizado < ?", (limite_colgado,))
+        # Las operaciones de un mismo envío salen en orden: una edición espera a que salga su alta.
+        # Solo se toman las de usuarios con token en este proceso; las encoladas antes de registrar el
+        # usuario (NULL) salen con el de cualquier sesión.
+        row = conn.execute(
+            f"SELECT * FROM bandeja_salida b WHERE estado='pendiente' AND proximo_intento <= ? "
+            f"AND (usuario IS NULL OR usuario IN ({', '.join('?' * len(usuarios))})) AND NOT EXISTS ("
+            "SELECT 1 FROM bandeja_salida a WHERE a.instance_id = b.instance_id AND a.id < b.id "
+            "AND a.estado IN ('pendiente', 'enviando')) ORDER BY id LIMIT 1", (time.time(), *usuarios)
+        ).fetchone()
+        if row is None:
+            return None
+        # El UPDATE condicional evita que otro proceso del servidor tome la misma operación.
+        tomada = conn.execute(
+            "UPDATE bandeja_salida SET estado='enviando', actualizado=? WHERE id=? AND estado='pendiente'",
+            (_ahora_iso(), row['id']),
+        ).rowcount
+        conn.commit()
+        return dict(row) if tomada else None
+
+    def _enviar(self, cliente, operacion):
+        if operacion['operacion'] == 'eliminar':
+            return cliente.eliminar_envio(operacion['instance_id'])
+        datos = json.loads(operacion['datos'])
+        if operacion['operacion'] == 'crear':
+            xml = xml_envio(self.form_id, operacion['version_formulario'], datos, operacion['instance_id'])
+            return cliente.crear_envio(xml)
+        xml = xml_envio(self.form_id, operacion['version_formulario'], datos, operacion['nuevo_instance_id'], operacion['deprecated_id'])
+        return cliente.editar_envio(operacion['instance_id'], xml)
+
+    def _edicion_aplicada(self, cliente, operacion):
+        return operacion['operacion'] == 'editar' and cliente.instance_id_vigente(operacion['instance_id']) == operacion['nuevo_instance_id']
+
+    def procesar_siguiente(self):
+        with self._condicion:
+            tokens = dict(self._tokens)
+        if not tokens:
+            return False
+        espejo_odk.init_db()
+        conn = espejo_odk.get_db()
+        try:
+            operacion = self._tomar_siguiente(conn, list(tokens))
+            if operacion is None:
+                return False
+            usuario = operacion['usuario'] or next(iter(tokens))
+            token = tokens[usuario]
+            estado, error = 'enviado', None
+            try:
+                cliente = ClienteODK(self.base_url, self.form_id, token)
+                response = self._enviar(cliente, operacion)
+                codigo = response.status_code
+                if codigo == 401:
+                    # Token vencido: la operación espera, con backoff, a que ese usuario vuelva a iniciar sesión.
+                    with self._condicion:
+                        if self._tokens.get(usuario) == token:
+                            del self._tokens[usuario]
+                    estado, error = 'reintentar', f"{codigo} {response.text[:200]}"
+                elif codigo == 409:
+                    # Un alta repetida ya llegó. Una edición con 409 choca con otra edición, salvo que la versión
+                    # vigente sea la nuestra: un intento anterior se aplicó aunque devolvió error.
+                    if operacion['operacion'] != 'crear' and not self._edicion_aplicada(cliente, operacion):
+                        estado, error = 'conflicto', response.text[:500]
+                elif codigo == 404 and operacion['operacion'] == 'eliminar':
+                    pass
+                elif codigo >= 500 or codigo == 429:
+                    estado, error = 'reintentar', f"{codigo} {response.text[:200]}"
+                elif codigo >= 400:
+                    estado, error = 'error', f"{codigo} {response.text[:500]}"
+            except requests.exceptions.RequestException as e:
+                estado, error = 'reintentar', str(e)
+            intentos = operacion['intentos'] + (1 if estado == 'reintentar' else 0)
+            proximo = time.time() + min(ESPERA_INICIAL * 2 ** intentos, ESPERA_MAXIMA) if estado == 'reintentar' else 0
+            conn.execute(
+                'UPDATE bandeja_salida SET estado=?, intentos=?, ultimo_error=?, proximo_intento=?, actualizado=? WHERE id=?',
+                ('pendiente' if estado == 'reintentar' else estado, intentos, error, proximo, _ahora_iso(), operacion['id']),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        if estado in ('conflicto', 'error'):
+            espejo_odk.forzar_resincronizacion()
+        return estado != 'pendiente'
@@ -0,0 +1,75 @@
+import os
+import sys
+import timeit
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matriz  # noqa: E402
+from datos_sinteticos import a_dataframe, generar_envios  # noqa: E402
+
+
+def matriz_original(df_completo, fecha_inicio_periodo, fecha_fin_periodo):
+    # Copia del doble bucle que usaba actualizar_matriz antes de la versión vectorizada.
+    df_periodo = df_completo[(df_completo['fecha'].dt.date >= fecha_inicio_periodo) & (df_completo['fecha'].dt.date <= fecha_fin_periodo)]
+    empleados_activos = sorted(df_periodo['empleado'].unique()) if not df_periodo.empty else []
+    agg_funcs = {'horas': ['sum', 'count'], 'horas_extra': 'sum', 'tarea': 'first'}
+    matriz_agregada = df_periodo.pivot_table(index='empleado', columns=df_completo['fecha'].dt.date, values=['horas', 'horas_extra', 'tarea'], aggfunc=agg_funcs).reindex(empleados_activos)
+    matriz_display = pd.DataFrame(index=empleados_activos); rango_dias_periodo = pd.date_range(start=fecha_inicio_periodo, end=fecha_fin_periodo)
+    for fecha_obj in rango_dias_periodo:
+        fecha = fecha_obj.date(); col_display = []
+        for empleado in empleados_activos:
+            try:
+                suma_horas = matriz_agregada.loc[empleado, ('horas', 'sum', fecha)]
+                suma_horas_extra = matriz_agregada.loc[empleado, ('horas_extra', 'sum', fecha)]
+                conteo = matriz_agregada.loc[empleado, ('horas', 'count', fecha)]
+                tarea = matriz_agregada.loc[empleado, ('tarea', 'first', fecha)]
+                texto_final = ""
+                if pd.notna(tarea) and str(tarea).strip().lower() == "falta":
+                    texto_final = "FALTA"
+                elif pd.notna(tarea) and ("feriado" in str(tarea).lower() or "certificado" in str(tarea).lower()):
+                    texto_final = "FERIADO"
+                elif pd.notna(tarea) and 'vacaciones' in str(tarea).lower():
+                    texto_final = "V"
+                elif pd.notna(tarea) and 'falta con aviso' in str(tarea).lower():
+                    texto_final = "CM"
+                elif conteo > 0:
+                    texto_horas = f"{int(suma_horas)}" if suma_horas == int(suma_horas) else f"{suma_horas:.1f}"
+                    if suma_horas_extra > 0: texto_horas += f" + {int(suma_horas_extra)}" if suma_horas_extra == int(suma_horas_extra) else f" + {suma_horas_extra:.1f}"
+                    texto_final = texto_horas
+                    if conteo > 1: texto_final = f"{texto_final}({int(conteo)})"
+                    total_horas_dia = suma_horas + suma_horas_extra
+                    es_viernes = fecha.weekday() == 4
+                    if (es_viernes and total_horas_dia > 8) or (not es_viernes and total_horas_dia > 9): texto_final += "!"
+                col_display.append(texto_final)
+            except KeyError: col_display.append("")
+        matriz_display[fecha] = col_display
+    return matriz_display
+
+
+def matriz_vectorizada(df_completo, fecha_inicio, fecha_fin):
+    texto, _ = matriz.construir_matriz(matriz.filtrar_periodo(df_completo, fecha_inicio, fecha_fin), fecha_inicio, fecha_fin)
+    return texto
+
+
+def main():
+    fecha_inicio, fecha_fin = matriz.rango_periodo('2024-05')
+    for empleados in (20, 150, 400):
+        # Más faltas, certificados y cargas duplicadas que por defecto, para cubrir todas las ramas del texto.
+        df = a_dataframe(generar_envios(
+            empleados, (fecha_fin - fecha_inicio).days + 61, fin=fecha_fin,
+            prob_duplicado=0.05, prob_falta=0.05, prob_falta_aviso=0.03, prob_certificado=0.03,
+        ))
+        original = matriz_original(df, fecha_inicio, fecha_fin)
+        vectorizada = matriz_vectorizada(df, fecha_inicio, fecha_fin)
+        pd.testing.assert_frame_equal(original, vectorizada, check_dtype=False)
+        repeticiones = 3
+        t_original = timeit.timeit(lambda: matriz_original(df, fecha_inicio, fecha_fin), number=repeticiones) / repeticiones
+        t_vectorizada = timeit.timeit(lambda: matriz_vectorizada(df, fecha_inicio, fecha_fin), number=repeticiones) / repeticiones
+        print(f"{empleados:>4} empleados x {len(original.columns)} días: original {t_original * 1000:8.1f} ms | "
+              f"vectorizada {t_vectorizada * 1000:7.1f} ms | x{t_original / t_vectorizada:.1f}")
+
+
+if __name__ == '__main__':
+    main()
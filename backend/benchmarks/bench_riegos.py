@@ -0,0 +1,84 @@
+import argparse
+import atexit
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.py crea y migra su base al importarse: que no sea la real de backend/lotes.db.
+_DIR_IMPORT = tempfile.mkdtemp(prefix='bench_riegos_')
+atexit.register(shutil.rmtree, _DIR_IMPORT, ignore_errors=True)
+os.environ['RIEGOS_DB_PATH'] = os.path.join(_DIR_IMPORT, 'import.db')
+
+import app as riegos_app  # noqa: E402
+from db import Database  # noqa: E402
+
+
+class ConexionPorPeticion(Database):
+    # Comportamiento anterior: conexión nueva por petición, journal de rollback y synchronous=FULL.
+    def connection(self):
+        if 'conexion_bench' not in g:
+            g.conexion_bench = sqlite3.connect(self.path, isolation_level=None, timeout=5)
+            g.conexion_bench.row_factory = sqlite3.Row
+            g.conexion_bench.execute('PRAGMA journal_mode=DELETE')
+        return g.conexion_bench
+
+
+@riegos_app.app.teardown_appcontext
+def _cerrar_conexion(_error):
+    conn = g.pop('conexion_bench', None)
+    if conn is not None:
+        conn.close()
+
+
+def _cliente(fin, proporcion_escrituras, semilla):
+    rnd = random.Random(semilla)
+    client = riegos_app.app.test_client()
+    completadas = 0
+    while time.monotonic() < fin:
+        if rnd.random() < proporcion_escrituras:
+            r = client.post('/api/riegos', json={'lote': f'L{rnd.randrange(200)}', 'fecha': f'2024-{rnd.randrange(1, 13):02d}-{rnd.randrange(1, 29):02d}'})
+        else:
+            r = client.get('/api/riegos', query_string={'lote': f'L{rnd.randrange(200)}', 'limit': 50})
+        assert r.status_code < 400, r.status_code
+        completadas += 1
+    return completadas
+
+
+def medir(database, segundos, clientes, proporcion_escrituras, filas_iniciales):
+    riegos_app.db = database
+    with riegos_app.app.app_context():
+        riegos_app.init_db()
+        with database.transaction() as conn:
+            conn.executemany('INSERT INTO riegos (lote, fecha, nota) VALUES (?, ?, ?)',
+                             [(f'L{i % 200}', f'2023-{i % 12 + 1:02d}-{i % 28 + 1:02d}', '') for i in range(filas_iniciales)])
+    fin = time.monotonic() + segundos
+    with ThreadPoolExecutor(clientes) as pool:
+        total = sum(pool.map(lambda i: _cliente(fin, proporcion_escrituras, i), range(clientes)))
+    return total / segundos
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Carga concurrente sobre /api/riegos')
+    parser.add_argument('--segundos', type=float, default=5)
+    parser.add_argument('--clientes', type=int, default=8)
+    parser.add_argument('--escrituras', type=float, default=0.2)
+    parser.add_argument('--filas', type=int, default=20000)
+    parser.add_argument('--dir', default=None, help='directorio para las bases (por defecto, uno temporal)')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for nombre, clase in (('conexión por petición', ConexionPorPeticion), ('Database (WAL)', Database)):
+            rps = medir(clase(os.path.join(tmp, f'{clase.__name__}.db')), args.segundos, args.clientes, args.escrituras, args.filas)
+            print(f'{nombre:>22}: {rps:8.1f} req/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import datetime
+import random
+import uuid
+
+import pandas as pd
+
+CECOS = ['Frutales Norte', 'Frutales Sur', 'Galpón', 'Mantenimiento', 'Vivero']
+TAREAS = ['Poda', 'Raleo', 'Cosecha', 'Riego', 'Fumigación', 'Tractorista', 'Mantenimiento', 'Empaque']
+
+
+def _iso(momento):
+    return momento.strftime('%Y-%m-%dT%H:%M:%S.') + f'{momento.microsecond // 1000:03d}Z'
+
+
+def _envio(rnd, empleado, fecha, tarea, horas, horas_extra, guardia='no', nota=''):
+    instance_id = f"uuid:{uuid.UUID(int=rnd.getrandbits(128), version=4)}"
+    enviado = datetime.datetime.combine(fecha, datetime.time(18)) + datetime.timedelta(minutes=rnd.randrange(0, 60 * 48))
+    enviado = min(enviado, datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None))
+    return {
+        '__id': instance_id, 'fecha': fecha.isoformat(), 'empleado': empleado, 'ceco': rnd.choice(CECOS), 'tarea': tarea,
+        'nota': nota, 'horas': horas, 'horas_extra': horas_extra, 'guardia': guardia,
+        'meta': {'instanceID': instance_id},
+        '__system': {'submissionDate': _iso(enviado), 'updatedAt': None, 'submitterName': 'supervisor', 'reviewState': None},
+    }
+
+
+def generar_envios(empleados=50, dias=90, fin=None, semilla=0, prob_duplicado=0.03, prob_falta=0.02,
+                   prob_falta_aviso=0.01, prob_certificado=0.01, prob_extra=0.15, prob_sin_carga=0.02):
+    # Envíos con la forma del feed OData de "RDT Frutales": jornadas normales, horas extra,
+    # cargas duplicadas, faltas, certificados, feriados comunes y un bloque de vacaciones por empleado.
+    rnd = random.Random(semilla)
+    fin = fin or datetime.date.today()
+    fechas = [fin - datetime.timedelta(days=d) for d in range(dias - 1, -1, -1)]
+    feriados = {f for f in fechas if f.weekday() < 5 and rnd.random() < 1 / 30}
+    envios = []
+    for e in range(empleados):
+        empleado = f"Empleado {e:03d}"
+        inicio_vacaciones = rnd.randrange(len(fechas)) if rnd.random() < min(1, dias / 180) else None
+        vacaciones = set(fechas[inicio_vacaciones:inicio_vacaciones + rnd.randint(5, 10)]) if inicio_vacaciones is not None else set()
+        for fecha in fechas:
+            if fecha.weekday() == 6 or (fecha.weekday() == 5 and rnd.random() < 0.6) or rnd.random() < prob_sin_carga:
+                continue
+            if fecha in feriados:
+                envios.append(_envio(rnd, empleado, fecha, 'Feriado', 0, 0))
+                continue
+            if fecha in vacaciones:
+                envios.append(_envio(rnd, empleado, fecha, 'Vacaciones', 0, 0))
+                continue
+            sorteo = rnd.random()
+            if sorteo < prob_falta:
+                envios.append(_envio(rnd, empleado, fecha, 'Falta', 0, 0))
+                continue
+            if sorteo < prob_falta + prob_falta_aviso:
+                envios.append(_envio(rnd, empleado, fecha, 'Falta con aviso', 0, 0))
+                continue
+            if sorteo < prob_falta + prob_falta_aviso + prob_certificado:
+                envios.append(_envio(rnd, empleado, fecha, 'Certificado médico', 0, 0))
+                continue
+            horas = 4 if fecha.weekday() == 5 else (8 if fecha.weekday() == 4 else rnd.choice([8, 8, 8.5, 9]))
+            extra = rnd.choice([1, 1.5, 2, 3]) if rnd.random() < prob_extra else 0
+            envios.append(_envio(rnd, empleado, fecha, rnd.choice(TAREAS), horas, extra, guardia=rnd.choice(['no'] * 9 + ['si'])))
+            if rnd.random() < prob_duplicado:
+                envios.append(_envio(rnd, empleado, fecha, rnd.choice(TAREAS), rnd.choice([2, 4, 8]), 0))
+    return envios
+
+
+def a_dataframe(envios):
+    df = pd.DataFrame(envios)
+    df['fecha'] = pd.to_datetime(df['fecha'], errors='coerce')
+    df['horas'] = pd.to_numeric(df['horas'], errors='coerce').fillna(0)
+    df['horas_extra'] = pd.to_numeric(df['horas_extra'], errors='coerce').fillna(0)
+    return df.dropna(subset=['fecha'])
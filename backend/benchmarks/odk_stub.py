@@ -0,0 +1,192 @@
+import argparse
+import base64
+import datetime
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import xml.etree.ElementTree as ET
+
+from urllib.parse import urlencode
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from datos_sinteticos import generar_envios  # noqa: E402
+
+CAMPOS = ['fecha', 'empleado', 'ceco', 'tarea', 'nota', 'horas', 'horas_extra', 'guardia']
+_CLAUSULA = re.compile(r"^\s*([\w/]+)\s+(eq|ne|gt|ge|lt|le)\s+'?([^']*?)'?\s*$")
+_OPERADORES = {
+    'eq': lambda a, b: a == b, 'ne': lambda a, b: a != b, 'gt': lambda a, b: a > b,
+    'ge': lambda a, b: a >= b, 'lt': lambda a, b: a < b, 'le': lambda a, b: a <= b,
+}
+
+
+def _valor(envio, campo):
+    valor = envio
+    for parte in campo.split('/'):
+        valor = (valor or {}).get(parte)
+    return valor
+
+
+def _clausula(texto):
+    match = _CLAUSULA.match(texto)
+    if not match:
+        raise ValueError(f'filtro no soportado: {texto}')
+    campo, operador, esperado = match.groups()
+    return campo.split('/'), _OPERADORES[operador], esperado
+
+
+def _cumple(envio, clausula):
+    partes, operador, esperado = clausula
+    valor = envio
+    for parte in partes:
+        valor = (valor or {}).get(parte)
+    return valor is not None and operador(str(valor), esperado)
+
+
+def filtrar(envios, expresion):
+    # Subconjunto de $filter de OData: cláusulas "campo op valor" unidas por and/or, sin paréntesis.
+    if not expresion:
+        return envios
+    alternativas = [[_clausula(c) for c in re.split(r'\s+and\s+', alt)] for alt in re.split(r'\s+or\s+', expresion)]
+    return [e for e in envios if any(all(_cumple(e, c) for c in alt) for alt in alternativas)]
+
+
+def _ahora_iso():
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def _leer_xml(cuerpo):
+    raiz = ET.fromstring(cuerpo)
+    datos = {campo: (raiz.findtext(campo) or '') for campo in CAMPOS}
+    meta = raiz.find('meta')
+    return datos, meta.findtext('instanceID'), meta.findtext('deprecatedID')
+
+
+def crear_stub(envios=None, form_id='RDT Frutales', version='1', latencia=0.0):
+    # Imita los endpoints de ODK Central que usa el dashboard, sobre una lista de envíos en memoria.
+    app = Flask('odk_stub')
+    # 'orden' imita el orden estable de Central (por creación), que es lo que sigue el $skiptoken.
+    estado = {'envios': {e['__id']: e for e in (envios or [])}, 'lock': threading.Lock(), 'peticiones': 0}
+    estado['orden'] = {i: n for n, i in enumerate(estado['envios'])}
+    app.config['ESTADO'] = estado
+    base = '/v1/projects/<int:project_id>/forms/<form>'
+
+    @app.before_request
+    def contar():
+        estado['peticiones'] += 1
+        if latencia:
+            threading.Event().wait(latencia)
+
+    @app.route(base + '.svc/Submissions', methods=['GET'])
+    def submissions(project_id, form):
+        with estado['lock']:
+            todos = list(estado['envios'].values())
+        try:
+            seleccion = filtrar(todos, request.args.get('$filter'))
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        if request.args.get('$orderby'):
+            campo, _, sentido = request.args['$orderby'].partition(' ')
+            seleccion = sorted((e for e in seleccion if _valor(e, campo) is not None), key=lambda e: _valor(e, campo),
+                               reverse=sentido.strip() == 'desc')
+        else:
+            seleccion.sort(key=lambda e: estado['orden'][e['__id']])
+        if request.args.get('$skiptoken'):
+            desde = json.loads(base64.urlsafe_b64decode(request.args['$skiptoken']))['orden']
+            seleccion = [e for e in seleccion if estado['orden'][e['__id']] > desde]
+        skip = int(request.args.get('$skip', 0))
+        top = request.args.get('$top')
+        pagina = seleccion[skip:skip + int(top)] if top is not None else seleccion[skip:]
+        siguiente = None
+        if top is not None and not request.args.get('$orderby') and skip + int(top) < len(seleccion) and pagina:
+            token = base64.urlsafe_b64encode(json.dumps({'orden': estado['orden'][pagina[-1]['__id']]}).encode()).decode()
+            argumentos = {k: v for k, v in request.args.items() if k not in ('$skip', '$skiptoken')}
+            siguiente = f"{request.base_url}?{urlencode(dict(argumentos, **{'$skiptoken': token}))}"
+        if request.args.get('$select'):
+            campos = [c.strip() for c in request.args['$select'].split(',')]
+            pagina = [{c: e.get(c) for c in campos} for e in pagina]
+        cuerpo = {'value': pagina}
+        if request.args.get('$count') == 'true':
+            cuerpo['@odata.count'] = len(seleccion)
+        if siguiente:
+            cuerpo['@odata.nextLink'] = siguiente
+        return jsonify(cuerpo)
+
+    @app.route(base, methods=['GET'])
+    def formulario(project_id, form):
+        return jsonify({'xmlFormId': form, 'version': version, 'state': 'open'})
+
+    @app.route(base + '/submissions', methods=['POST'])
+    def crear(project_id, form):
+        datos, instance_id, _ = _leer_xml(request.get_data())
+        with estado['lock']:
+            if instance_id in estado['envios']:
+                return jsonify({'code': 409.3, 'message': 'duplicate instanceID'}), 409
+            estado['orden'][instance_id] = max(estado['orden'].values(), default=-1) + 1
+            estado['envios'][instance_id] = dict(
+                datos, __id=instance_id, meta={'instanceID': instance_id},
+                __system={'submissionDate': _ahora_iso(), 'updatedAt': None},
+            )
+        return Response(status=201)
+
+    @app.route(base + '/submissions/<instance_id>', methods=['PUT'])
+    def editar(project_id, form, instance_id):
+        datos, nuevo_id, deprecated_id = _leer_xml(request.get_data())
+        with estado['lock']:
+            envio = estado['envios'].get(instance_id)
+            if envio is None:
+                return jsonify({'message': 'not found'}), 404
+            if deprecated_id != envio['meta']['instanceID']:
+                return jsonify({'code': 409.1, 'message': 'deprecatedID is not the current version'}), 409
+            envio.update(datos, meta={'instanceID': nuevo_id})
+            envio['__system'] = dict(envio['__system'], updatedAt=_ahora_iso())
+        return jsonify({'instanceId': instance_id})
+
+    @app.route(base + '/submissions/<instance_id>', methods=['DELETE'])
+    def eliminar(project_id, form, instance_id):
+        with estado['lock']:
+            if estado['envios'].pop(instance_id, None) is None:
+                return jsonify({'message': 'not found'}), 404
+        return Response(status=204)
+
+    return app
+
+
+class ServidorStub:
+    def __init__(self, app, puerto=0):
+        self.servidor = make_server('127.0.0.1', puerto, app, threaded=True)
+        self.hilo = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.servidor.server_port}/v1'
+
+    def __enter__(self):
+        self.hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.servidor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ODK Central local con envíos sintéticos')
+    parser.add_argument('--empleados', type=int, default=50)
+    parser.add_argument('--dias', type=int, default=180)
+    parser.add_argument('--puerto', type=int, default=8383)
+    parser.add_argument('--latencia', type=float, default=0.0, help='segundos agregados a cada petición')
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    envios = generar_envios(args.empleados, args.dias)
+    print(f'{len(envios)} envíos en http://127.0.0.1:{args.puerto}/v1 (usar como BASE_URL)')
+    crear_stub(envios, latencia=args.latencia).run(port=args.puerto, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
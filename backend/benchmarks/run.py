@@ -0,0 +1,151 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import pandas as pd  # noqa: E402
+
+import bench_riegos  # noqa: E402
+import dash_app  # noqa: E402
+import espejo_odk  # noqa: E402
+from datos_sinteticos import generar_envios  # noqa: E402
+from db import Database  # noqa: E402
+from odk_stub import ServidorStub, crear_stub  # noqa: E402
+
+RESULTADOS = os.path.join(BENCH_DIR, 'resultados.jsonl')
+TAMANIOS = '20x60,150x180,300x730'
+TOKEN = 'bench'
+
+
+def _cronometrar(funcion, repeticiones=5, antes=None):
+    tiempos = []
+    for _ in range(repeticiones):
+        if antes:
+            antes()
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+def _periodo_actual(hoy):
+    fin = hoy if hoy.day <= 15 else hoy.replace(day=28) + datetime.timedelta(days=4)
+    return f"{fin.year}-{fin.month:02d}"
+
+
+def _espejo_vacio(tmp, nombre):
+    dash_app.precarga.submit(lambda: None).result()
+    espejo_odk.DB_PATH = os.path.join(tmp, f'odk_{nombre}_{time.perf_counter_ns()}.db')
+    espejo_odk._db_inicializada = None
+    dash_app.cache_df.invalidar()
+    dash_app.vuelo_odk.olvidar()
+
+
+def _primera_matriz(sesion, periodo):
+    # Carga por período desde un espejo vacío hasta tener la matriz del período elegido.
+    datos_store, _, _, _, _ = dash_app.fetch_data_from_odk(0, sesion, periodo)
+    dash_app.actualizar_matriz(datos_store, periodo, sesion, None)
+
+
+def medir_dashboard(empleados, dias, repeticiones, tmp):
+    envios = generar_envios(empleados, dias)
+    resultados = {'envios': len(envios)}
+    espejo_completo = espejo_odk.DB_PATH = os.path.join(tmp, f'odk_{empleados}x{dias}.db')
+    espejo_odk._db_inicializada = None
+    dash_app.cache_df.invalidar()
+    dash_app.vuelo_odk.olvidar()
+    sesion = {'token': TOKEN}
+    periodo = _periodo_actual(datetime.date.today())
+    with ServidorStub(crear_stub(envios, form_id=dash_app.FORM_ID)) as stub:
+        dash_app.BASE_URL = stub.base_url
+        resultados['cargar_datos_completos_inicial_ms'] = _cronometrar(lambda: dash_app.cargar_datos_completos(TOKEN), 1)
+        resultados['cargar_datos_completos_incremental_ms'] = _cronometrar(lambda: dash_app.cargar_datos_completos(TOKEN), repeticiones)
+        datos_store, _, _, _, _ = dash_app.fetch_data_from_odk(0, sesion, None)
+        resultados['primera_matriz_por_periodo_ms'] = _cronometrar(
+            lambda: _primera_matriz(sesion, periodo), repeticiones, antes=lambda: _espejo_vacio(tmp, f'{empleados}x{dias}'))
+        dash_app.precarga.submit(lambda: None).result()
+        espejo_odk.DB_PATH = espejo_completo
+        espejo_odk._db_inicializada = None
+    # Sobre el espejo completo y sin carga por período: se mide armar la matriz, no bajar de ODK.
+    carga_por_periodo, dash_app.CARGA_POR_PERIODO = dash_app.CARGA_POR_PERIODO, False
+    resultados['actualizar_matriz_frio_ms'] = _cronometrar(
+        lambda: dash_app.actualizar_matriz(datos_store, periodo, sesion, None), repeticiones, antes=dash_app.cache_df.invalidar)
+    resultados['actualizar_matriz_cache_ms'] = _cronometrar(lambda: dash_app.actualizar_matriz(datos_store, periodo, sesion, None), repeticiones)
+    resultados['actualizar_panel_alertas_ms'] = _cronometrar(lambda: dash_app.actualizar_panel_alertas(datos_store, sesion), repeticiones)
+    data_tabla, columnas, filas, _ = dash_app.actualizar_matriz(datos_store, periodo, sesion, None)
+    if data_tabla:
+        celda = {'row': len(data_tabla) // 2, 'column_id': columnas[len(columnas) // 2]['id']}
+        opciones = {'ceco': [], 'tarea': []}
+        resultados['manejar_clic_celda_ms'] = _cronometrar(
+            lambda: dash_app.manejar_clic_celda(celda, filas, datos_store, opciones, sesion), repeticiones)
+        resultados['parche_fila_ms'] = _cronometrar(
+            lambda: dash_app.parche_fila(filas, filas['empleados'][celda['row']]), repeticiones)
+    dash_app.CARGA_POR_PERIODO = carga_por_periodo
+    return resultados
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _ultima_corrida():
+    if not os.path.exists(RESULTADOS):
+        return None
+    with open(RESULTADOS, encoding='utf-8') as f:
+        lineas = [linea for linea in f if linea.strip()]
+    return json.loads(lineas[-1]) if lineas else None
+
+
+def _imprimir(corrida, anterior):
+    previos = (anterior or {}).get('resultados', {})
+    for tamanio, metricas in corrida['resultados'].items():
+        print(f"\n== {tamanio} ==")
+        for metrica, valor in metricas.items():
+            previo = previos.get(tamanio, {}).get(metrica)
+            delta = f"  ({(valor - previo) / previo * 100:+.0f}% vs {anterior['commit']})" if previo else ''
+            print(f"  {metrica:<42} {valor:>10.1f}{delta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks del dashboard y del API de riegos contra un ODK local')
+    parser.add_argument('--tamanios', default=TAMANIOS, help='lista de EMPLEADOSxDIAS separada por comas')
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--segundos-riegos', type=float, default=3)
+    parser.add_argument('--no-guardar', action='store_true', help=f'no agregar la corrida a {os.path.basename(RESULTADOS)}')
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    corrida = {
+        'fecha': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': _commit_actual(),
+        'python': platform.python_version(), 'pandas': pd.__version__, 'resultados': {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for tamanio in args.tamanios.split(','):
+            empleados, dias = map(int, tamanio.lower().split('x'))
+            corrida['resultados'][tamanio] = medir_dashboard(empleados, dias, args.repeticiones, tmp)
+        corrida['resultados']['riegos'] = {
+            'riegos_req_por_segundo': bench_riegos.medir(Database(os.path.join(tmp, 'riegos.db')), args.segundos_riegos, 8, 0.2, 20000),
+        }
+    anterior = _ultima_corrida()
+    _imprimir(corrida, anterior)
+    if not args.no_guardar:
+        with open(RESULTADOS, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(corrida, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    main()
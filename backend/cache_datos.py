@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+
+MAX_ENTRADAS = 8
+TTL_SEGUNDOS = 15 * 60
+MAX_BYTES = 512 * 1024 * 1024
+
+
+def _tamanio(valor):
+    if isinstance(valor, (tuple, list)):
+        return sum(_tamanio(v) for v in valor)
+    try:
+        return int(valor.memory_usage(index=True, deep=True).sum())
+    except AttributeError:
+        return 0
+
+
+class CacheDataFrames:
+    # Los DataFrames se comparten entre callbacks: quien los lea no debe modificarlos in-place.
+
+    def __init__(self, max_entradas=MAX_ENTRADAS, ttl=TTL_SEGUNDOS, max_bytes=MAX_BYTES):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            valor, guardado, tamanio = entrada
+            if time.monotonic() - guardado > self.ttl:
+                self._quitar(clave)
+                return None
+            self._entradas.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor):
+        tamanio = _tamanio(valor)
+        with self._lock:
+            if clave in self._entradas:
+                self._quitar(clave)
+            if tamanio > self.max_bytes:
+                return valor
+            self._entradas[clave] = (valor, time.monotonic(), tamanio)
+            self._bytes += tamanio
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                self._quitar(next(iter(self._entradas)))
+        return valor
+
+    def obtener_o_cargar(self, clave, cargar):
+        valor = self.obtener(clave)
+        if valor is None:
+            valor = self.guardar(clave, cargar())
+        return valor
+
+    def invalidar(self, prefijo=''):
+        with self._lock:
+            for clave in [c for c in self._entradas if str(c).startswith(prefijo)]:
+                self._quitar(clave)
+
+    def _quitar(self, clave):
+        _, _, tamanio = self._entradas.pop(clave)
+        self._bytes -= tamanio
+
+    def __len__(self):
+        return len(self._entradas)
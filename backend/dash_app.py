@@ -1,86 +1,143 @@
 import dash
-from dash import html, dcc, dash_table, callback, Input, Output, State, no_update, ALL
-import pandas as pd
-import requests
+from dash import html, dcc, dash_table, Input, Output, State, no_update, ALL, Patch
 import datetime
 from dateutil.relativedelta import relativedelta
-import uuid
 import calendar
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+import requests
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
 
-app = dash.Dash(__name__, suppress_callback_exceptions=True, title="Control y Carga")
+import cache_datos
+from bandeja_salida import BandejaSalida
+import espejo_odk
+import matriz
+import metricas
+import reportes
+from odk_cliente import ClienteODK
+from vuelo_unico import VueloUnico
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Con diskcache la sincronización con ODK corre como callback en segundo plano, en un proceso aparte,
+# y no ocupa un worker del servidor mientras baja las páginas. Sin él corre en el request como antes.
+cache_tareas = diskcache.Cache(os.path.join(BASE_DIR, 'cache_tareas')) if diskcache else None
+if cache_tareas is not None: espejo_odk.sincronizar_entre_procesos(cache_tareas)
+app = dash.Dash(
+    __name__, suppress_callback_exceptions=True, title="Control y Carga",
+    background_callback_manager=dash.DiskcacheManager(cache_tareas) if cache_tareas is not None else None,
+)
+metricas.instrumentar_flask(app.server, 'dash')
+callback = metricas.callback_medido(dash.callback)
 
 BASE_URL = "https://pomco.strangled.net/v1"
 FORM_ID = "RDT Frutales"
+# Baja de ODK solo el período elegido y la ventana de alertas; el resto del historial se pide al navegar.
+CARGA_POR_PERIODO = True
+DIAS_ALERTA = 14
+# Pestañas que refrescan a la vez comparten una sola sincronización, y su resultado vale estos segundos.
+FRESCURA_SYNC = 10
+
+# Cada celda de día lleva su categoría como clase en un span que ocupa toda la celda (sin :has(), que las
+# tablets con Chrome < 105 o Firefox < 121 no soportan); la tabla usa estas reglas fijas en vez de filtros por columna.
+ESTILOS_CATEGORIA = {
+    matriz.VACIO: 'background-color: #ffeef0', matriz.VACIO_FINDE: 'background-color: #f8f9fa',
+    matriz.FALTA: 'background-color: #f8d7da; font-weight: bold', matriz.FERIADO: 'background-color: #d1ecf1; font-weight: bold',
+    matriz.VACACIONES: 'background-color: #fff3cd; font-weight: bold', matriz.CM: 'background-color: #cfe2ff; font-weight: bold',
+    matriz.MULTIPLE: 'background-color: #fd7e14; color: white; font-weight: bold',
+    matriz.EXCESO: 'background-color: #dc3545; color: white; font-weight: bold', matriz.NORMAL: 'background-color: #d1e7dd',
+}
+CSS_MATRIZ = [{'selector': f'.cat-{categoria}', 'rule': regla} for categoria, regla in ESTILOS_CATEGORIA.items()] + [
+    {'selector': '.cell-markdown p', 'rule': 'margin: 0; height: 100%'},
+    {'selector': '.cell-markdown span[class^="cat-"]', 'rule': 'display: block; height: 100%; padding: 5px 2px; box-sizing: border-box'},
+]
+
+def cliente_odk(token):
+    return ClienteODK(BASE_URL, FORM_ID, token)
+
+def huella_token(token):
+    # Identifica la sesión sin guardar el token en el espejo.
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
 
-def get_auth_header(token):
-    return {'Authorization': f'Bearer {token}'}
+cache_df = cache_datos.CacheDataFrames()
+pases_descarga = reportes.PasesDescarga(cache_tareas)
+reportes.registrar_rutas(app.server, cliente_odk, pases_descarga)
+bandeja = BandejaSalida(BASE_URL, FORM_ID)
+# Hilo propio: la precarga usa el pool de odk_cliente para las páginas y no puede esperar dentro de él.
+precarga = ThreadPoolExecutor(max_workers=1, thread_name_prefix='precarga')
+vuelo_odk = VueloUnico(FRESCURA_SYNC, cache_tareas)
 
 def cargar_datos_completos(token):
-    odata_url = f"{BASE_URL}/projects/1/forms/{FORM_ID}.svc/Submissions?$top=5000"
-    form_details_url = f"{BASE_URL}/projects/1/forms/{FORM_ID}"
-    headers = get_auth_header(token)
-    response_odata = requests.get(odata_url, headers=headers)
-    response_odata.raise_for_status()
-    df = pd.DataFrame(response_odata.json()['value'])
-    response_form = requests.get(form_details_url, headers=headers)
-    response_form.raise_for_status()
-    version = response_form.json()['version']
-    df['fecha'] = pd.to_datetime(df['fecha'], errors='coerce')
-    df['horas'] = pd.to_numeric(df['horas'], errors='coerce').fillna(0)
-    df['horas_extra'] = pd.to_numeric(df['horas_extra'], errors='coerce').fillna(0)
-    df.dropna(subset=['fecha'], inplace=True)
-    return df, version
-
-def crear_o_editar_envio(token, datos_formulario, version_formulario, instance_id_original=None):
-    try:
-        es_edicion = instance_id_original is not None
-        new_instance_id = f"uuid:{uuid.uuid4()}"
-        meta_xml = (
-            f"<deprecatedID>{instance_id_original}</deprecatedID><instanceID>{new_instance_id}</instanceID>"
-            if es_edicion else
-            f"<instanceID>{new_instance_id}</instanceID>"
-        )
-        xml_string = f"""<data id=\"{FORM_ID}\" version=\"{version_formulario}\">
-            <fecha>{datos_formulario['fecha'].strftime('%Y-%m-%d')}</fecha>
-            <empleado>{datos_formulario['empleado']}</empleado>
-            <ceco>{datos_formulario['ceco']}</ceco>
-            <tarea>{datos_formulario['tarea']}</tarea>
-            <nota>{datos_formulario['nota']}</nota>
-            <horas>{datos_formulario['horas']}</horas>
-            <horas_extra>{datos_formulario['horas_extra']}</horas_extra>
-            <guardia>{datos_formulario['guardia']}</guardia>
-            <meta>{meta_xml}</meta>
-        </data>"""
-        headers = get_auth_header(token)
-        headers['Content-Type'] = 'application/xml;charset=UTF-8'
-        if es_edicion:
-            url = f"{BASE_URL}/projects/1/forms/{FORM_ID}/submissions/{instance_id_original}"
-            response = requests.put(url, data=xml_string.encode('utf-8'), headers=headers)
-            mensaje = "¡Éxito! Se editó el envío."
-        else:
-            url = f"{BASE_URL}/projects/1/forms/{FORM_ID}/submissions"
-            response = requests.post(url, data=xml_string.encode('utf-8'), headers=headers)
-            mensaje = "¡Éxito! Se creó el envío."
-        if response.status_code == 409:
-            return False, "CONFLICT"
-        response.raise_for_status()
-        return True, mensaje
-    except requests.exceptions.HTTPError as e:
-        return False, f"Error de API: {e.response.status_code} {e.response.text}"
-    except Exception as e:
-        return False, f"Error inesperado: {e}"
-
-def eliminar_registro_odk(token, instance_id):
-    try:
-        headers = get_auth_header(token)
-        url = f"{BASE_URL}/projects/1/forms/{FORM_ID}/submissions/{instance_id}"
-        response = requests.delete(url, headers=headers)
-        if response.status_code == 204:
-            return True, "Registro eliminado exitosamente."
-        else:
-            return False, f"Error al eliminar: {response.status_code} {response.text}"
-    except Exception as e:
-        return False, f"Error inesperado: {e}"
+    espejo_odk.sincronizar_envios(cliente_odk(token))
+    return espejo_odk.version_formulario(), espejo_odk.version_datos()
+
+def cargar_datos_periodo(token, periodo):
+    cliente = cliente_odk(token)
+    hoy = datetime.date.today()
+    rangos = [(hoy - datetime.timedelta(days=DIAS_ALERTA), hoy)]
+    if periodo: rangos.append(matriz.rango_periodo(periodo))
+    espejo_odk.cargar_rangos(cliente, rangos)
+    espejo_odk.sincronizar_envios(cliente)
+    return espejo_odk.version_formulario(), espejo_odk.version_datos()
+
+def matriz_periodo(version, fecha_inicio, fecha_fin):
+    def construir():
+        with metricas.cronometro(metricas.MATRIZ):
+            resumen = espejo_odk.leer_resumen(fecha_inicio, fecha_fin)
+            return None if resumen.empty else matriz.construir_matriz_desde_resumen(resumen, fecha_inicio, fecha_fin)
+    return cache_df.obtener_o_cargar(f"matriz:{version}:{fecha_inicio}", construir)
+
+def precargar_periodos_vecinos(token, periodo):
+    # Deja bajados y en cache el período anterior y el siguiente al elegido.
+    def precargar():
+        primero = datetime.date.fromisoformat(f"{periodo}-01")
+        vecinos = [matriz.rango_periodo((primero + relativedelta(months=d)).strftime('%Y-%m')) for d in (-1, 1)]
+        espejo_odk.cargar_rangos(cliente_odk(token), vecinos)
+        version = espejo_odk.version_datos()
+        for fecha_inicio, fecha_fin in vecinos: matriz_periodo(version, fecha_inicio, fecha_fin)
+    precarga.submit(precargar)
+
+def celda_html(texto, categoria):
+    return f'<span class="cat-{categoria}">{texto}</span>'
+
+def filas_tabla(texto, categoria):
+    columnas = [str(c) for c in texto.columns]
+    return [
+        {'empleado': empleado, **dict(zip(columnas, map(celda_html, fila_texto, fila_categoria)))}
+        for empleado, fila_texto, fila_categoria in zip(texto.index, texto.to_numpy(dtype=object), categoria.to_numpy(dtype=object))
+    ]
+
+def parche_fila(filas_matriz, empleado):
+    # Recalcula solo la fila del empleado en la matriz que ya tiene el navegador. None si no está en ella.
+    if not filas_matriz or empleado not in filas_matriz['empleados']: return None
+    fecha_inicio, fecha_fin = matriz.rango_periodo(filas_matriz['periodo'])
+    resumen = espejo_odk.leer_resumen(fecha_inicio, fecha_fin, empleado)
+    fila = {'empleado': empleado}
+    for dia, texto, categoria in matriz.fila_desde_resumen(resumen, fecha_inicio, fecha_fin): fila[str(dia)] = celda_html(texto, categoria)
+    parche = Patch()
+    parche[filas_matriz['empleados'].index(empleado)] = fila
+    return parche
+
+def actualizar_fila(filas_matriz, empleado, version):
+    # Parche de la fila y filas_matriz con la nueva versión, para que actualizar_matriz no rearme la tabla.
+    # Si el empleado no está en la tabla (primera carga del período) se deja que la reconstruya.
+    parche = parche_fila(filas_matriz, empleado)
+    if parche is None: return no_update, no_update
+    return parche, dict(filas_matriz, version=version)
+
+def opciones_de_periodo(fecha_min, fecha_max):
+    opciones_periodo = []
+    if fecha_min:
+        start_loop_date = fecha_min.replace(day=1)
+        while True:
+            año, mes = start_loop_date.year, start_loop_date.month
+            if start_loop_date.replace(day=15) > fecha_max + relativedelta(months=2): break
+            opciones_periodo.append({'label': f"Período {calendar.month_name[mes]} {año}", 'value': f"{año}-{mes:02d}"})
+            start_loop_date += relativedelta(months=1)
+    return sorted(opciones_periodo, key=lambda x: x['value'], reverse=True)
 
 def layout():
     return html.Div(id='dashboard-wrapper')
@@ -101,14 +158,19 @@ def render_page_content(session_data):
         dcc.Store(id='store-form-version'),
         dcc.Store(id='store-trigger-refresh', data=0),
         dcc.Store(id='store-selected-period', storage_type='session'),
+        dcc.Store(id='store-bandeja-visto'),
+        dcc.Store(id='store-matriz-filas'),
+        dcc.Interval(id='intervalo-bandeja', interval=3000),
         html.Div(className='header', children=[
             html.H1("📋 Control y Carga de Horas"),
+            html.Div(id='estado-sincronizacion', style={'color': 'gray'}),
             html.A(html.Button('Cerrar Sesión'), href='/logout', style={'position': 'absolute', 'top': '20px', 'right': '20px'})
         ]),
         dcc.Loading(type="circle", children=html.Div(id='panel-alertas', className='panel')),
         html.Div(className='panel-filtros', children=[
             html.H4("Seleccionar Período de Trabajo"),
             dcc.Dropdown(id='filtro-periodo'),
+            html.Div(id='enlaces-reporte', style={'marginTop': '10px'}),
         ]),
         html.Div(className='panel', children=[
             html.H3(id='titulo-matriz'),
@@ -116,9 +178,13 @@ def render_page_content(session_data):
                 dash_table.DataTable(
                     id='tabla-interactiva',
                     data=[], columns=[],
+                    markdown_options={'html': True}, css=CSS_MATRIZ,
                     style_cell_conditional=[
                         {'if': {'column_id': 'empleado'}, 'width': '200px', 'textAlign': 'left', 'fontWeight': 'bold'}
-                    ]
+                    ],
+                    # Sin padding en las celdas de día el span de la categoría las pinta enteras.
+                    style_data={'padding': 0},
+                    style_data_conditional=[{'if': {'column_id': 'empleado'}, 'padding': '0 5px'}]
                 )
             ]),
             html.P("🟩 Normal | 🟥 Exceso | 🟧 Múltiple | 🟨 Vacaciones | 🟦 CM", style={'textAlign': 'center', 'marginTop': '10px', 'fontSize': '14px'})
@@ -127,133 +193,114 @@ def render_page_content(session_data):
             html.H3("👇 Acción Rápida"),
             dcc.Loading(id="loading-accion", children=html.Div(id='zona-accion')),
             html.Div(id='notificacion-guardado', style={'marginTop': '15px'}),
-            html.Div(id='notificacion-eliminar', style={'marginTop': '15px'})
+            html.Div(id='notificacion-eliminar', style={'marginTop': '15px'}),
+            html.Div(id='estado-bandeja', style={'marginTop': '15px'})
         ]),
     ])
 
 @callback(Output('store-selected-period', 'data'), Input('filtro-periodo', 'value'), prevent_initial_call=True)
 def save_selected_period(periodo): return periodo
 
+@callback(Output('enlaces-reporte', 'children'), Input('filtro-periodo', 'value'), State('session-store', 'data'))
+def actualizar_enlaces_reporte(periodo, session_data):
+    if not periodo or not session_data or not session_data.get('token'): return []
+    enlaces = [("Resumen del período (CSV)", f"/reportes/{periodo}.csv"), ("Resumen del período (XLSX)", f"/reportes/{periodo}.xlsx"), ("Todos los períodos (CSV)", "/reportes/todos.csv")]
+    # Sin openpyxl la ruta .xlsx responde 501: no se ofrece el enlace.
+    if reportes.openpyxl is None: enlaces = [e for e in enlaces if not e[1].endswith('.xlsx')]
+    pase = pases_descarga.emitir(session_data['token'])
+    return [html.A(texto, href=f"{href}?pase={pase}", download='', style={'marginRight': '15px'}) for texto, href in enlaces]
+
 @callback(
     [Output('store-main-data', 'data'), Output('store-opciones-dropdown', 'data'), Output('store-form-version', 'data'), Output('filtro-periodo', 'options'), Output('filtro-periodo', 'value')],
     [Input('store-trigger-refresh', 'data')],
-    [State('session-store', 'data'), State('store-selected-period', 'data')]
+    [State('session-store', 'data'), State('store-selected-period', 'data')],
+    background=cache_tareas is not None,
+    running=[(Output('estado-sincronizacion', 'children'), "🔄 Sincronizando con ODK...", "")]
 )
 def fetch_data_from_odk(trigger_value, session_data, saved_period):
     if not session_data or not session_data.get('token'): return no_update, no_update, no_update, [], None
     try:
-        df, version_formulario = cargar_datos_completos(session_data['token'])
-        opciones_ceco = sorted(df['ceco'].astype(str).unique())
-        opciones_tarea = sorted(df['tarea'].astype(str).unique())
-        opciones_periodo = []
-        if not df.empty:
-            fecha_min, fecha_max = df['fecha'].min().date(), df['fecha'].max().date()
-            start_loop_date = fecha_min.replace(day=1)
-            while True:
-                año, mes = start_loop_date.year, start_loop_date.month
-                if start_loop_date.replace(day=15) > fecha_max + relativedelta(months=2): break
-                opciones_periodo.append({'label': f"Período {calendar.month_name[mes]} {año}", 'value': f"{año}-{mes:02d}"})
-                start_loop_date += relativedelta(months=1)
-        opciones_periodo = sorted(opciones_periodo, key=lambda x: x['value'], reverse=True)
+        token = session_data['token']
+        def refrescar():
+            if not CARGA_POR_PERIODO:
+                return cargar_datos_completos(token)
+            espejo_odk.actualizar_rango_fechas(cliente_odk(token))
+            opciones = espejo_odk.opciones_envios()
+            opciones_periodo = opciones_de_periodo(opciones['fecha_min'], opciones['fecha_max'])
+            return cargar_datos_periodo(token, saved_period or (opciones_periodo[0]['value'] if opciones_periodo else None))
+        version_formulario, version_datos = vuelo_odk.ejecutar(f"periodo:{saved_period}" if CARGA_POR_PERIODO else 'completa', refrescar)
+        opciones = espejo_odk.opciones_envios()
+        opciones_periodo = opciones_de_periodo(opciones['fecha_min'], opciones['fecha_max'])
         valor_periodo_default = saved_period if saved_period else (opciones_periodo[0]['value'] if opciones_periodo else None)
-        opciones_dropdown = {'ceco': opciones_ceco, 'tarea': opciones_tarea}
-        return df.to_json(orient='split', date_format='iso'), opciones_dropdown, version_formulario, opciones_periodo, valor_periodo_default
+        opciones_dropdown = {'ceco': opciones['ceco'], 'tarea': opciones['tarea']}
+        return {'version': version_datos}, opciones_dropdown, version_formulario, opciones_periodo, valor_periodo_default
     except Exception:
         return None, None, None, [], None
 
 @callback(
     Output('panel-alertas', 'children'),
-    Input('store-main-data', 'data')
+    Input('store-main-data', 'data'),
+    State('session-store', 'data')
 )
-def actualizar_panel_alertas(json_data):
-    if not json_data: return html.H4("Cargando datos para generar alertas...")
-    df_completo = pd.read_json(json_data, orient='split'); df_completo['fecha'] = pd.to_datetime(df_completo['fecha']).dt.date
+def actualizar_panel_alertas(datos_store, session_data):
+    # El store solo trae la versión y el espejo es compartido: sin token de la sesión no se lee nada.
+    if not datos_store or not session_data or not session_data.get('token'): return html.H4("Cargando datos para generar alertas...")
     hoy = datetime.date.today()
     if hoy.weekday() >= 5: fecha_a_revisar = hoy - datetime.timedelta(days=(hoy.weekday() - 4))
     else: fecha_a_revisar = hoy
     dias_semana_es = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
     nombre_dia_revisar = dias_semana_es[fecha_a_revisar.weekday()]
     fecha_limite_actividad = datetime.date.today() - datetime.timedelta(days=14)
-    empleados_activos = df_completo[df_completo['fecha'] >= fecha_limite_actividad]['empleado'].unique()
-    empleados_con_carga = df_completo[df_completo['fecha'] == fecha_a_revisar]['empleado'].unique()
-    empleados_faltantes = sorted(list(set(empleados_activos) - set(empleados_con_carga)))
+    empleados_activos = espejo_odk.empleados_con_carga(fecha_limite_actividad)
+    empleados_con_carga = espejo_odk.empleados_con_carga(fecha_a_revisar, fecha_a_revisar)
+    empleados_faltantes = sorted(empleados_activos - empleados_con_carga)
     if not empleados_faltantes:
         return html.H4(f"✅ ¡Al día! Sin cargas pendientes para el {nombre_dia_revisar} {fecha_a_revisar.strftime('%d/%m')}.", className='alerta-ok')
     else:
         return [html.H4(f"🚨 Cargas Faltantes para el {nombre_dia_revisar} {fecha_a_revisar.strftime('%d/%m')}", className='alerta-critica'), html.Ul([html.Li(e) for e in empleados_faltantes])]
 
 @callback(
-    [Output('tabla-interactiva', 'data'), Output('tabla-interactiva', 'columns'), Output('tabla-interactiva', 'style_data_conditional'), Output('titulo-matriz', 'children')],
-    [Input('store-main-data', 'data'), Input('filtro-periodo', 'value')]
+    [Output('tabla-interactiva', 'data'), Output('tabla-interactiva', 'columns'), Output('store-matriz-filas', 'data'), Output('titulo-matriz', 'children')],
+    [Input('store-main-data', 'data'), Input('filtro-periodo', 'value')],
+    [State('session-store', 'data'), State('store-matriz-filas', 'data')]
 )
-def actualizar_matriz(json_data, periodo_seleccionado):
-    if not json_data or not periodo_seleccionado: return [], [], [], "Cargando datos..."
-    df_completo = pd.read_json(json_data, orient='split'); df_completo['fecha'] = pd.to_datetime(df_completo['fecha'])
-    año_fin, mes_fin = map(int, periodo_seleccionado.split('-')); fecha_fin_periodo = datetime.date(año_fin, mes_fin, 15); fecha_inicio_periodo = (fecha_fin_periodo.replace(day=1) - datetime.timedelta(days=1)).replace(day=16)
+def actualizar_matriz(datos_store, periodo_seleccionado, session_data, filas_matriz):
+    if not datos_store or not periodo_seleccionado or not session_data or not session_data.get('token'): return [], [], None, "Cargando datos..."
+    # Después de guardar o eliminar la fila ya llegó como parche con esta versión: no se reconstruye la tabla.
+    if filas_matriz and filas_matriz['periodo'] == periodo_seleccionado and filas_matriz['version'] == datos_store['version']:
+        return no_update, no_update, no_update, no_update
+    fecha_inicio_periodo, fecha_fin_periodo = matriz.rango_periodo(periodo_seleccionado)
     titulo = f"Matriz de Cumplimiento ({fecha_inicio_periodo.strftime('%d/%m')} - {fecha_fin_periodo.strftime('%d/%m')})"
-    df_periodo = df_completo[(df_completo['fecha'].dt.date >= fecha_inicio_periodo) & (df_completo['fecha'].dt.date <= fecha_fin_periodo)]
-    empleados_activos = sorted(df_periodo['empleado'].unique()) if not df_periodo.empty else []
-    if not empleados_activos: return [], [], [], titulo
-    agg_funcs = {'horas': ['sum', 'count'], 'horas_extra': 'sum', 'tarea': 'first'}
-    matriz_agregada = df_periodo.pivot_table(index='empleado', columns=df_completo['fecha'].dt.date, values=['horas', 'horas_extra', 'tarea'], aggfunc=agg_funcs).reindex(empleados_activos)
-    matriz_display = pd.DataFrame(index=empleados_activos); rango_dias_periodo = pd.date_range(start=fecha_inicio_periodo, end=fecha_fin_periodo)
-    for fecha_obj in rango_dias_periodo:
-        fecha = fecha_obj.date(); col_display = []
-        for empleado in empleados_activos:
-            try:
-                suma_horas = matriz_agregada.loc[empleado, ('horas', 'sum', fecha)]
-                suma_horas_extra = matriz_agregada.loc[empleado, ('horas_extra', 'sum', fecha)]
-                conteo = matriz_agregada.loc[empleado, ('horas', 'count', fecha)]
-                tarea = matriz_agregada.loc[empleado, ('tarea', 'first', fecha)]
-                texto_final = ""
-                if pd.notna(tarea) and str(tarea).strip().lower() == "falta":
-                    texto_final = "FALTA"
-                elif pd.notna(tarea) and ("feriado" in str(tarea).lower() or "certificado" in str(tarea).lower()):
-                    texto_final = "FERIADO"
-                elif pd.notna(tarea) and 'vacaciones' in str(tarea).lower():
-                    texto_final = "V"
-                elif pd.notna(tarea) and 'falta con aviso' in str(tarea).lower():
-                    texto_final = "CM"
-                elif conteo > 0:
-                    texto_horas = f"{int(suma_horas)}" if suma_horas == int(suma_horas) else f"{suma_horas:.1f}"
-                    if suma_horas_extra > 0: texto_horas += f" + {int(suma_horas_extra)}" if suma_horas_extra == int(suma_horas_extra) else f" + {suma_horas_extra:.1f}"
-                    texto_final = texto_horas
-                    if conteo > 1: texto_final = f"{texto_final}({int(conteo)})"
-                    total_horas_dia = suma_horas + suma_horas_extra
-                    es_viernes = fecha.weekday() == 4
-                    if (es_viernes and total_horas_dia > 8) or (not es_viernes and total_horas_dia > 9): texto_final += "!"
-                col_display.append(texto_final)
-            except KeyError: col_display.append("")
-        matriz_display[fecha] = col_display
-    estilos = []
-    for fecha in matriz_display.columns:
-        col_id_str = str(fecha)
-        estilos.append({'if': {'column_id': col_id_str, 'filter_query': f'{{{col_id_str}}} = ""'}, 'backgroundColor': '#f8f9fa' if fecha.weekday() >= 5 else '#ffeef0'})
-        estilos.append({'if': {'column_id': col_id_str, 'filter_query': f'{{{col_id_str}}} = "FALTA"'}, 'backgroundColor': '#f8d7da', 'fontWeight': 'bold'})
-        estilos.append({'if': {'column_id': col_id_str, 'filter_query': f'{{{col_id_str}}} = "FERIADO"'}, 'backgroundColor': '#d1ecf1', 'fontWeight': 'bold'})
-        estilos.append({'if': {'column_id': col_id_str, 'filter_query': f'{{{col_id_str}}} = "V"'}, 'backgroundColor': '#fff3cd', 'fontWeight': 'bold'})
-        estilos.append({'if': {'column_id': col_id_str, 'filter_query': f'{{{col_id_str}}} = "CM"'}, 'backgroundColor': '#cfe2ff', 'fontWeight': 'bold'})
-        estilos.append({'if': {'column_id': col_id_str, 'filter_query': f'{{{col_id_str}}} contains "("'}, 'backgroundColor': '#fd7e14', 'color': 'white', 'fontWeight': 'bold'})
-        estilos.append({'if': {'column_id': col_id_str, 'filter_query': f'{{{col_id_str}}} contains "!"'}, 'backgroundColor': '#dc3545', 'color': 'white', 'fontWeight': 'bold'})
-        estilos.append({'if': {'column_id': col_id_str, 'filter_query': f'{{{col_id_str}}} != "" && {{{col_id_str}}} != "FALTA" && {{{col_id_str}}} != "FERIADO" && {{{col_id_str}}} != "V" && {{{col_id_str}}} != "CM" && !({{{col_id_str}}} contains "(") ) && !({{{col_id_str}}} contains "!")'}, 'backgroundColor': '#d1e7dd'})
-    for col in matriz_display.columns: matriz_display[col] = matriz_display[col]
-    matriz_display.columns = [str(c) for c in matriz_display.columns]; matriz_display.reset_index(inplace=True); matriz_display.rename(columns={'index': 'empleado'}, inplace=True)
-    columnas_tabla = [{"name": str(datetime.date.fromisoformat(c).day), "id": c} if c != 'empleado' else {"name": "Empleado", "id": "empleado"} for c in matriz_display.columns]
-    datos_tabla = matriz_display.to_dict('records')
-    return datos_tabla, columnas_tabla, estilos, titulo
+    version = datos_store['version']
+    if CARGA_POR_PERIODO and session_data and session_data.get('token'):
+        try:
+            vuelo_odk.ejecutar(f"rango:{periodo_seleccionado}", lambda: espejo_odk.cargar_rangos(
+                cliente_odk(session_data['token']), [(fecha_inicio_periodo, fecha_fin_periodo)]))
+        except requests.RequestException:
+            pass  # sin conexión con ODK se muestra lo que ya tiene el espejo
+        version = espejo_odk.version_datos()
+        precargar_periodos_vecinos(session_data['token'], periodo_seleccionado)
+    precarga.submit(reportes.materializar, periodo_seleccionado)  # el reporte del período queda listo para descargar
+    matrices = matriz_periodo(version, fecha_inicio_periodo, fecha_fin_periodo)
+    filas = {'periodo': periodo_seleccionado, 'version': datos_store['version'], 'empleados': []}
+    if matrices is None: return [], [], filas, titulo
+    texto, categoria = matrices
+    filas['empleados'] = list(texto.index)
+    columnas_tabla = [{"name": "Empleado", "id": "empleado"}] + [{"name": str(fecha.day), "id": str(fecha), "presentation": "markdown"} for fecha in texto.columns]
+    return filas_tabla(texto, categoria), columnas_tabla, filas, titulo
 
 @callback(
     [Output('zona-accion', 'children'), Output('store-memoria-celda', 'data')],
     [Input('tabla-interactiva', 'active_cell')],
-    [State('tabla-interactiva', 'data'), State('store-main-data', 'data'), State('store-opciones-dropdown', 'data')]
+    [State('store-matriz-filas', 'data'), State('store-main-data', 'data'), State('store-opciones-dropdown', 'data'), State('session-store', 'data')]
 )
-def manejar_clic_celda(active_cell, data_tabla, json_data, opciones_dropdown):
-    if not active_cell or not data_tabla or not json_data: return html.P("Hacé clic en una celda de la matriz para actuar."), no_update
-    df_completo = pd.read_json(json_data, orient='split'); df_completo['fecha'] = pd.to_datetime(df_completo['fecha'])
+def manejar_clic_celda(active_cell, filas_matriz, datos_store, opciones_dropdown, session_data):
+    if not session_data or not session_data.get('token'): return html.P("Error de sesión.", style={'color': 'red'}), no_update
+    if not active_cell or not filas_matriz or not datos_store: return html.P("Hacé clic en una celda de la matriz para actuar."), no_update
     row_idx, col_id = active_cell['row'], active_cell['column_id']
     if col_id == 'empleado': return html.P("Seleccionaste un empleado. Por favor, hacé clic en una celda de día."), no_update
-    empleado = data_tabla[row_idx]['empleado']; fecha_celda = datetime.date.fromisoformat(col_id)
-    datos_existentes = df_completo[(df_completo['empleado'] == empleado) & (df_completo['fecha'].dt.date == fecha_celda)]
+    empleado = filas_matriz['empleados'][row_idx]; fecha_celda = datetime.date.fromisoformat(col_id)
+    datos_existentes = espejo_odk.leer_envios_dia(empleado, fecha_celda)
     if len(datos_existentes) > 1:
         botones = []
         for idx, row in datos_existentes.iterrows():
@@ -264,7 +311,7 @@ def manejar_clic_celda(active_cell, data_tabla, json_data, opciones_dropdown):
             html.H4(f"⚠️ Múltiples Cargas para: {empleado} el {fecha_celda.strftime('%d/%m/%Y')}"),
             dash_table.DataTable(data=datos_existentes[['ceco', 'tarea', 'horas', 'horas_extra', 'nota']].to_dict('records')),
             html.Div(botones)
-        ]), no_update
+        ]), {'empleado': empleado, 'instance_id': None}
     valores_form = {"ceco": None, "tarea": None, "horas": None, "horas_extra": 0, "guardia": "no", "nota": "", "instance_id": None}
     titulo_form, texto_boton = f"➕ Cargar para: {empleado}", "Guardar Nueva Carga"
     if not datos_existentes.empty:
@@ -290,7 +337,9 @@ def manejar_clic_celda(active_cell, data_tabla, json_data, opciones_dropdown):
 @callback(
     [Output('notificacion-guardado', 'children'),
      Output('notificacion-eliminar', 'children'),
-     Output('store-trigger-refresh', 'data')],
+     Output('store-main-data', 'data', allow_duplicate=True),
+     Output('tabla-interactiva', 'data', allow_duplicate=True),
+     Output('store-matriz-filas', 'data', allow_duplicate=True)],
     [
         Input('btn-guardar', 'n_clicks'),
         Input({'type': 'btn-eliminar-dup', 'index': ALL}, 'n_clicks')
@@ -302,21 +351,23 @@ def manejar_clic_celda(active_cell, data_tabla, json_data, opciones_dropdown):
         State('input-fecha-carga', 'date'), State('input-ceco', 'value'), State('input-tarea', 'value'),
         State('input-horas', 'value'), State('input-horas_extra', 'value'),
         State('input-guardia', 'value'), State('input-nota', 'value'),
-        State({'type': 'btn-eliminar-dup', 'index': ALL}, 'id')
+        State({'type': 'btn-eliminar-dup', 'index': ALL}, 'id'),
+        State('store-matriz-filas', 'data')
     ],
     prevent_initial_call=True
 )
 def procesar_guardar_y_eliminar(
     n_clicks_guardar, n_clicks_eliminar, session_data, version_formulario, datos_memoria,
-    fecha, ceco, tarea, horas, horas_extra, guardia, nota, eliminar_ids
+    fecha, ceco, tarea, horas, horas_extra, guardia, nota, eliminar_ids, filas_matriz
 ):
     ctx = dash.callback_context
     noti_guardado = no_update
     noti_eliminar = no_update
-    trigger_refresh = no_update
+    datos_store = no_update
+    tabla, filas = no_update, no_update
 
     if not ctx.triggered:
-        return noti_guardado, noti_eliminar, trigger_refresh
+        return noti_guardado, noti_eliminar, datos_store, tabla, filas
 
     triggered_id = ctx.triggered_id
 
@@ -327,34 +378,63 @@ def procesar_guardar_y_eliminar(
             noti_guardado = html.P("Error de sesión.", style={'color': 'red'})
         else:
             datos_formulario = {
-                "fecha": datetime.date.fromisoformat(fecha), "empleado": datos_memoria['empleado'], "ceco": ceco,
+                "fecha": datetime.date.fromisoformat(fecha).isoformat(), "empleado": datos_memoria['empleado'], "ceco": ceco,
                 "tarea": tarea, "horas": horas, "horas_extra": horas_extra or 0, "guardia": guardia or "no", "nota": nota or ""
             }
-            success, message = crear_o_editar_envio(session_data['token'], datos_formulario, version_formulario, instance_id_original=datos_memoria.get('instance_id'))
-            if message == "CONFLICT":
-                noti_guardado = html.P("Registro actualizado. Refrescando datos, intente de nuevo.", style={'color': 'orange'})
-                trigger_refresh = datetime.datetime.now().timestamp()
-            elif success:
-                noti_guardado = html.P(message, style={'color': 'green'})
-                trigger_refresh = datetime.datetime.now().timestamp()
-            else:
-                noti_guardado = html.P(message, style={'color': 'red'})
-        return noti_guardado, no_update, trigger_refresh
+            instance_id = datos_memoria.get('instance_id')
+            bandeja.registrar_token(huella_token(session_data['token']), session_data['token'])
+            bandeja.encolar('editar' if instance_id else 'crear', instance_id, datos_formulario, version_formulario,
+                            usuario=huella_token(session_data['token']))
+            mensaje = "¡Guardado! Se editó la carga; se enviará a ODK en segundo plano." if instance_id else "¡Guardado! Se creó la carga; se enviará a ODK en segundo plano."
+            noti_guardado = html.P(mensaje, style={'color': 'green'})
+            datos_store = {'version': espejo_odk.version_datos()}
+            tabla, filas = actualizar_fila(filas_matriz, datos_memoria['empleado'], datos_store['version'])
+        return noti_guardado, no_update, datos_store, tabla, filas
 
     if isinstance(triggered_id, dict) and triggered_id.get('type') == 'btn-eliminar-dup':
         idx = [i for i, btn_id in enumerate(eliminar_ids) if btn_id == triggered_id]
         if idx and session_data and session_data.get('token'):
-            instance_id = triggered_id['index']
-            success, msg = eliminar_registro_odk(session_data['token'], instance_id)
-            color = 'green' if success else 'red'
-            noti_eliminar = html.P(msg, style={'color': color})
-            trigger_refresh = datetime.datetime.now().timestamp()
-            return no_update, noti_eliminar, trigger_refresh
+            bandeja.registrar_token(huella_token(session_data['token']), session_data['token'])
+            bandeja.encolar('eliminar', triggered_id['index'], usuario=huella_token(session_data['token']))
+            noti_eliminar = html.P("Registro eliminado; se enviará a ODK en segundo plano.", style={'color': 'green'})
+            datos_store = {'version': espejo_odk.version_datos()}
+            tabla, filas = actualizar_fila(filas_matriz, (datos_memoria or {}).get('empleado'), datos_store['version'])
+            return no_update, noti_eliminar, datos_store, tabla, filas
         else:
             noti_eliminar = html.P("Error al eliminar registro.", style={'color': 'red'})
-            return no_update, noti_eliminar, no_update
+            return no_update, noti_eliminar, no_update, no_update, no_update
+
+    return noti_guardado, noti_eliminar, datos_store, tabla, filas
 
-    return noti_guardado, noti_eliminar, trigger_refresh
+@callback(
+    [Output('estado-bandeja', 'children'), Output('store-bandeja-visto', 'data'), Output('store-trigger-refresh', 'data')],
+    Input('intervalo-bandeja', 'n_intervals'),
+    [State('store-bandeja-visto', 'data'), State('session-store', 'data')]
+)
+def actualizar_estado_bandeja(n_intervals, ultimo_visto, session_data):
+    # Acá y no en la sincronización: esa puede correr en otro proceso y la bandeja envía desde este.
+    if not session_data or not session_data.get('token'): return [], no_update, no_update
+    bandeja.registrar_token(huella_token(session_data['token']), session_data['token'])
+    # Cada sesión ve, y recarga por, solo los cambios que encoló ella.
+    resumen = bandeja.resumen(huella_token(session_data['token']))
+    nombres = {'crear': 'la carga', 'editar': 'la edición', 'eliminar': 'la eliminación'}
+    hijos = []
+    if resumen['pendientes']:
+        hijos.append(html.P(f"⏳ {resumen['pendientes']} cambio(s) pendiente(s) de envío a ODK.", style={'color': 'gray'}))
+    for aviso in resumen['avisos']:
+        detalle = f" de {aviso['empleado']} ({aviso['fecha']})" if aviso['empleado'] else ""
+        if aviso['estado'] == 'conflicto':
+            texto = f"⚠️ Conflicto en {nombres[aviso['operacion']]}{detalle}: otro usuario modificó el registro. Se recargaron los datos, intente de nuevo."
+        else:
+            texto = f"❌ ODK rechazó {nombres[aviso['operacion']]}{detalle}: {aviso['ultimo_error']}"
+        hijos.append(html.P(texto, style={'color': 'orange' if aviso['estado'] == 'conflicto' else 'red'}))
+    maximo = max([a['id'] for a in resumen['avisos']], default=0)
+    if ultimo_visto is None:
+        return hijos, maximo, no_update
+    if maximo > ultimo_visto:
+        vuelo_odk.olvidar()  # el refresco por un conflicto tiene que volver a ODK
+        return hijos, maximo, datetime.datetime.now().timestamp()
+    return hijos, no_update, no_update
 
 if __name__ == "__main__":
     app.run_server(debug=True)
@@ -0,0 +1,647 @@
+import contextlib
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+import requests
+
+import matriz
+import metricas
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, 'odk_espejo.db')
+
+# Margen que se resta a la marca de agua para no perder envíos con el mismo timestamp.
+SOLAPAMIENTO = datetime.timedelta(seconds=5)
+# Cada cuánto se reconcilian los IDs completos para detectar borrados hechos fuera del dashboard.
+INTERVALO_RECONCILIACION = datetime.timedelta(minutes=15)
+INTERVALO_VERSION_FORMULARIO = datetime.timedelta(hours=1)
+# En la carga por período la primera marca de agua se toma del reloj local; el margen cubre su desfase con ODK.
+MARGEN_RELOJ = datetime.timedelta(minutes=5)
+# __id por pedido al bajar envíos que faltan en el espejo; acota el largo de la URL del $filter.
+LOTE_IDS = 50
+
+CAMPOS_ENVIO = ['fecha', 'empleado', 'ceco', 'tarea', 'nota', 'horas', 'horas_extra', 'guardia']
+# Tipos del resumen diario que lee la matriz de cada período: categóricas y float32 en lugar de object y float64.
+TIPOS_RESUMEN = {
+    'empleado': 'category', 'tarea': 'category', 'categoria': matriz.TIPO_CATEGORIA, 'horas': 'float32', 'horas_extra': 'float32',
+}
+
+SQL_UPSERT_ENVIO = (
+    'INSERT INTO envios (id, fecha, empleado, ceco, tarea, nota, horas, horas_extra, guardia, submission_date, updated_at, datos) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+    'ON CONFLICT(id) DO UPDATE SET fecha=excluded.fecha, empleado=excluded.empleado, ceco=excluded.ceco, '
+    'tarea=excluded.tarea, nota=excluded.nota, horas=excluded.horas, horas_extra=excluded.horas_extra, '
+    'guardia=excluded.guardia, submission_date=excluded.submission_date, updated_at=excluded.updated_at, '
+    'datos=excluded.datos WHERE envios.datos IS NOT excluded.datos'
+)
+
+# Si quien sincroniza muere con el candado de diskcache tomado, los demás lo recuperan pasado este tiempo.
+EXPIRACION_CANDADO_SYNC = 10 * 60
+
+_lock_sync = threading.Lock()
+_cache_sync = None
+_db_inicializada = None
+
+
+def _reiniciar_en_hijo():
+    # El fork pudo copiar el lock tomado por otro hilo del padre.
+    global _lock_sync
+    _lock_sync = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_en_hijo)
+
+
+def sincronizar_entre_procesos(cache):
+    # Los callbacks en segundo plano corren cada uno en su proceso: con un diskcache.Cache compartido
+    # las sincronizaciones y cargas de rangos de todos ellos se hacen de a una, no solo las de un proceso.
+    global _cache_sync
+    _cache_sync = cache
+
+
+@contextlib.contextmanager
+def _sincronizando():
+    with _lock_sync:
+        if _cache_sync is None:
+            yield
+            return
+        import diskcache
+
+        with diskcache.Lock(_cache_sync, f'espejo-odk:sync:{DB_PATH}', expire=EXPIRACION_CANDADO_SYNC):
+            yield
+
+
+def get_db():
+    # WAL: la bandeja de salida escribe mientras una sincronización lee o escribe el espejo.
+    conn = sqlite3.connect(DB_PATH, timeout=30, factory=metricas.ConexionMedida)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+def init_db():
+    global _db_inicializada
+    if _db_inicializada == DB_PATH:
+        return
+    conn = get_db()
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS envios (
+            id TEXT PRIMARY KEY,
+            fecha TEXT,
+            empleado TEXT,
+            ceco TEXT,
+            tarea TEXT,
+            nota TEXT,
+            horas REAL,
+            horas_extra REAL,
+            guardia TEXT,
+            submission_date TEXT,
+            updated_at TEXT,
+            datos TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_envios_fecha ON envios (fecha);
+        CREATE INDEX IF NOT EXISTS idx_envios_empleado_fecha ON envios (empleado, fecha);
+        CREATE TABLE IF NOT EXISTS sync_estado (
+            clave TEXT PRIMARY KEY,
+            valor TEXT
+        );
+        CREATE TABLE IF NOT EXISTS bandeja_salida (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            operacion TEXT NOT NULL,
+            instance_id TEXT NOT NULL,
+            nuevo_instance_id TEXT,
+            deprecated_id TEXT,
+            datos TEXT,
+            version_formulario TEXT,
+            estado TEXT NOT NULL DEFAULT 'pendiente',
+            intentos INTEGER NOT NULL DEFAULT 0,
+            ultimo_error TEXT,
+            proximo_intento REAL NOT NULL DEFAULT 0,
+            creado TEXT,
+            actualizado TEXT,
+            usuario TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_bandeja_estado ON bandeja_salida (estado, id);
+        CREATE TABLE IF NOT EXISTS resumen_diario (
+            empleado TEXT NOT NULL,
+            fecha TEXT NOT NULL,
+            horas REAL NOT NULL,
+            horas_extra REAL NOT NULL,
+            conteo INTEGER NOT NULL,
+            tarea TEXT,
+            categoria TEXT NOT NULL,
+            texto TEXT NOT NULL,
+            PRIMARY KEY (empleado, fecha)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_resumen_fecha ON resumen_diario (fecha);
+        CREATE TABLE IF NOT EXISTS resumen_pendiente (
+            empleado TEXT NOT NULL,
+            fecha TEXT NOT NULL,
+            PRIMARY KEY (empleado, fecha)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS periodo_version (
+            periodo TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS reporte_periodo (
+            periodo TEXT NOT NULL,
+            empleado TEXT NOT NULL,
+            ceco TEXT,
+            tarea TEXT,
+            horas REAL NOT NULL,
+            horas_extra REAL NOT NULL,
+            dias_guardia INTEGER NOT NULL,
+            dias_falta INTEGER NOT NULL,
+            dias_cm INTEGER NOT NULL,
+            dias_vacaciones INTEGER NOT NULL,
+            dias_exceso INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_reporte_periodo ON reporte_periodo (periodo, empleado);
+        CREATE TABLE IF NOT EXISTS reporte_version (
+            periodo TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TRIGGER IF NOT EXISTS envios_resumen_ai AFTER INSERT ON envios BEGIN
+            INSERT OR IGNORE INTO resumen_pendiente VALUES (NEW.empleado, date(NEW.fecha));
+        END;
+        CREATE TRIGGER IF NOT EXISTS envios_resumen_au AFTER UPDATE ON envios BEGIN
+            INSERT OR IGNORE INTO resumen_pendiente VALUES (OLD.empleado, date(OLD.fecha));
+            INSERT OR IGNORE INTO resumen_pendiente VALUES (NEW.empleado, date(NEW.fecha));
+        END;
+        CREATE TRIGGER IF NOT EXISTS envios_resumen_ad AFTER DELETE ON envios BEGIN
+            INSERT OR IGNORE INTO resumen_pendiente VALUES (OLD.empleado, date(OLD.fecha));
+        END;
+        """
+    )
+    # Espejos creados antes de que la bandeja registrara quién encoló cada cambio.
+    if 'usuario' not in {row['name'] for row in conn.execute('PRAGMA table_info(bandeja_salida)')}:
+        conn.execute('ALTER TABLE bandeja_salida ADD COLUMN usuario TEXT')
+    if _leer_estado(conn, 'resumen_construido') is None:
+        conn.execute('INSERT OR IGNORE INTO resumen_pendiente SELECT empleado, date(fecha) FROM envios')
+        actualizar_resumen(conn)
+        _guardar_estado(conn, 'resumen_construido', 1)
+    if _leer_estado(conn, 'periodos_versionados') is None:
+        fechas = [row[0] for row in conn.execute('SELECT DISTINCT fecha FROM resumen_diario')]
+        periodos = {matriz.periodo_de_fecha(datetime.date.fromisoformat(f)) for f in fechas}
+        conn.executemany('INSERT OR IGNORE INTO periodo_version (periodo, version) VALUES (?, 1)', [(p,) for p in periodos])
+        _guardar_estado(conn, 'periodos_versionados', 1)
+    conn.commit()
+    conn.close()
+    _db_inicializada = DB_PATH
+
+
+def actualizar_resumen(conn):
+    # Recalcula solo los (empleado, fecha) que los triggers de envios marcaron como modificados.
+    pendientes = pd.read_sql_query('SELECT empleado, fecha FROM resumen_pendiente', conn)
+    if pendientes.empty:
+        return 0
+    envios = pd.read_sql_query(
+        'SELECT e.empleado, date(e.fecha) AS fecha, e.horas, e.horas_extra, e.tarea FROM envios e '
+        'JOIN resumen_pendiente p ON p.empleado = e.empleado AND p.fecha = date(e.fecha) ORDER BY e.rowid', conn,
+        dtype={'empleado': 'category', 'tarea': 'category'},
+    )
+    conn.executemany('DELETE FROM resumen_diario WHERE empleado=? AND fecha=?', pendientes.itertuples(index=False))
+    if not envios.empty:
+        envios['fecha'] = pd.to_datetime(envios['fecha'])
+        agregado = matriz.agregar_por_dia(envios)
+        celdas = matriz.celdas_desde_agregado(agregado).join(agregado)
+        conn.executemany(
+            'INSERT INTO resumen_diario (empleado, fecha, horas, horas_extra, conteo, tarea, categoria, texto) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [
+                (empleado, dia.date().isoformat(), float(fila.horas), float(fila.horas_extra), int(fila.conteo),
+                 None if pd.isna(fila.tarea) else fila.tarea, fila.categoria, fila.texto)
+                for (empleado, dia), fila in zip(celdas.index, celdas.itertuples(index=False))
+            ],
+        )
+    # Cada período tocado cambia de versión: así se sabe qué reportes materializados quedaron viejos.
+    periodos = {matriz.periodo_de_fecha(datetime.date.fromisoformat(f)) for f in pendientes['fecha'].dropna().unique()}
+    conn.executemany(
+        'INSERT INTO periodo_version (periodo, version) VALUES (?, 1) ON CONFLICT(periodo) DO UPDATE SET version = version + 1',
+        [(periodo,) for periodo in periodos],
+    )
+    conn.execute('DELETE FROM resumen_pendiente')
+    return len(pendientes)
+
+
+def _leer_estado(conn, clave, default=None):
+    row = conn.execute('SELECT valor FROM sync_estado WHERE clave=?', (clave,)).fetchone()
+    return row['valor'] if row else default
+
+
+def _guardar_estado(conn, clave, valor):
+    conn.execute('INSERT OR REPLACE INTO sync_estado (clave, valor) VALUES (?, ?)', (clave, str(valor)))
+
+
+def _ahora():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _a_numero(valor):
+    try:
+        return float(valor) if valor not in (None, '') else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def proyectar_envio(registro):
+    # Lo único del envío que usa el espejo (también queda en envios.datos); el resto se descarta al parsear.
+    sistema = registro.get('__system') or {}
+    proyectado = {campo: registro.get(campo) for campo in CAMPOS_ENVIO}
+    proyectado['__id'] = registro['__id']
+    proyectado['meta'] = {'instanceID': (registro.get('meta') or {}).get('instanceID')}
+    proyectado['__system'] = {'submissionDate': sistema.get('submissionDate'), 'updatedAt': sistema.get('updatedAt')}
+    return proyectado
+
+
+def _fila_envio(registro):
+    sistema = registro.get('__system') or {}
+    return (
+        registro['__id'], registro.get('fecha'), registro.get('empleado'), registro.get('ceco'),
+        registro.get('tarea'), registro.get('nota'), _a_numero(registro.get('horas')),
+        _a_numero(registro.get('horas_extra')), registro.get('guardia'),
+        sistema.get('submissionDate'), sistema.get('updatedAt'), json.dumps(registro),
+    )
+
+
+def _marca_registro(registro):
+    sistema = registro.get('__system') or {}
+    return max(filter(None, [sistema.get('submissionDate'), sistema.get('updatedAt')]), default=None)
+
+
+def _ids_con_cambios_pendientes(conn):
+    return {row['instance_id'] for row in conn.execute(
+        "SELECT DISTINCT instance_id FROM bandeja_salida WHERE estado IN ('pendiente', 'enviando')"
+    )}
+
+
+def _leer_cobertura(conn):
+    # None: el espejo tiene todo el historial. Si no, lista de rangos de fechas (desde, hasta) ya bajados completos.
+    valor = _leer_estado(conn, 'cobertura')
+    if valor is None:
+        return None
+    return [tuple(datetime.date.fromisoformat(d) for d in rango) for rango in json.loads(valor)]
+
+
+def _unir_rangos(rangos):
+    unidos = []
+    for desde, hasta in sorted(rangos):
+        if unidos and desde <= unidos[-1][1] + datetime.timedelta(days=1):
+            unidos[-1] = (unidos[-1][0], max(unidos[-1][1], hasta))
+        else:
+            unidos.append((desde, hasta))
+    return unidos
+
+
+def _guardar_cobertura(conn, rangos):
+    _guardar_estado(conn, 'cobertura', json.dumps([[d.isoformat(), h.isoformat()] for d, h in _unir_rangos(rangos)]))
+
+
+def _rangos_faltantes(cobertura, desde, hasta):
+    faltantes, inicio = [], desde
+    for a, b in cobertura:
+        if b < inicio or a > hasta:
+            continue
+        if a > inicio:
+            faltantes.append((inicio, a - datetime.timedelta(days=1)))
+        inicio = max(inicio, b + datetime.timedelta(days=1))
+    if inicio <= hasta:
+        faltantes.append((inicio, hasta))
+    return faltantes
+
+
+def _filtro_fechas(rangos):
+    return ' or '.join(f'fecha ge {d.isoformat()} and fecha le {h.isoformat()}' for d, h in rangos)
+
+
+def _ids_locales(conn, rangos=None):
+    if rangos is None:
+        return {row['id'] for row in conn.execute('SELECT id FROM envios')}
+    condicion = ' OR '.join(['date(fecha) BETWEEN ? AND ?'] * len(rangos))
+    return {row['id'] for row in conn.execute(
+        f'SELECT id FROM envios WHERE {condicion}', [d.isoformat() for rango in rangos for d in rango]
+    )}
+
+
+def _reconciliar_ids(conn, cliente, pendientes, cobertura=None):
+    # Compara los __id locales con los de ODK: borra los que ya no existen y baja los que faltan en el espejo
+    # (por ejemplo envíos que una sincronización anterior no llegó a traer y que la marca de agua ya dejó atrás).
+    params = {'$select': '__id'}
+    if cobertura is not None:
+        params['$filter'] = _filtro_fechas(cobertura)
+    remotos = set()
+    for pagina in cliente.paginas_envios(params, proyectar=lambda r: r['__id']):
+        remotos.update(pagina)
+    locales = _ids_locales(conn, cobertura)
+    borrados = locales - remotos - pendientes
+    conn.executemany('DELETE FROM envios WHERE id=?', [(i,) for i in borrados])
+    faltantes = sorted(remotos - locales - pendientes)
+    recuperados = 0
+    try:
+        for inicio in range(0, len(faltantes), LOTE_IDS):
+            filtro = ' or '.join(f"__id eq '{i}'" for i in faltantes[inicio:inicio + LOTE_IDS])
+            for pagina in cliente.paginas_envios({'$filter': filtro}, proyectar=proyectar_envio):
+                antes = conn.total_changes
+                conn.executemany(SQL_UPSERT_ENVIO, [_fila_envio(r) for r in pagina])
+                recuperados += conn.total_changes - antes
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code != 400:
+            raise
+        # El servidor no filtra por __id: la próxima sincronización vuelve a bajar todo (o cada rango, por período).
+        if cobertura is not None:
+            _guardar_estado(conn, 'cobertura', '[]')
+        conn.execute("DELETE FROM sync_estado WHERE clave='marca_agua'")
+    return len(borrados), recuperados
+
+
+def _version_formulario_vencida(conn):
+    consultada = _leer_estado(conn, 'version_consultada')
+    if _leer_estado(conn, 'version_formulario') is None or not consultada:
+        return True
+    return _ahora() - datetime.datetime.fromisoformat(consultada) > INTERVALO_VERSION_FORMULARIO
+
+
+def sincronizar_envios(cliente, completa=False):
+    with _sincronizando():
+        init_db()
+        conn = get_db()
+        try:
+            # Los metadatos del formulario se piden en paralelo con las páginas de envíos.
+            futuro_formulario = cliente.en_segundo_plano(cliente.obtener_formulario) if _version_formulario_vencida(conn) else None
+            marca = None if completa else _leer_estado(conn, 'marca_agua')
+            cobertura = None if completa else _leer_cobertura(conn)
+            params = {}
+            if marca:
+                desde = (datetime.datetime.fromisoformat(marca.replace('Z', '+00:00')) - SOLAPAMIENTO).isoformat().replace('+00:00', 'Z')
+                params['$filter'] = f"__system/submissionDate ge {desde} or __system/updatedAt ge {desde}"
+            # Los envíos con cambios locales aún sin enviar conservan la versión optimista.
+            pendientes = _ids_con_cambios_pendientes(conn)
+            nueva_marca, cambios = marca, 0
+            # En la carga por período, sin marca todavía no se bajó ningún rango: no hay nada que actualizar.
+            paginas = cliente.paginas_envios(params, proyectar=proyectar_envio) if marca or cobertura is None else []
+            for pagina in paginas:
+                antes = conn.total_changes
+                conn.executemany(SQL_UPSERT_ENVIO, [_fila_envio(r) for r in pagina if r['__id'] not in pendientes])
+                # El solapamiento vuelve a traer envíos ya conocidos: solo cuentan los que cambiaron.
+                cambios += conn.total_changes - antes
+                nueva_marca = max(filter(None, [nueva_marca] + [_marca_registro(r) for r in pagina]), default=None)
+            if nueva_marca:
+                _guardar_estado(conn, 'marca_agua', nueva_marca)
+            ultima = _leer_estado(conn, 'ultima_reconciliacion')
+            reconciliar = completa or not ultima or _ahora() - datetime.datetime.fromisoformat(ultima) > INTERVALO_RECONCILIACION
+            if not reconciliar and cobertura != []:
+                filtro = {'$filter': _filtro_fechas(cobertura)} if cobertura else None
+                reconciliar = cliente.contar_envios(filtro) != len(_ids_locales(conn, cobertura))
+            borrados = 0
+            if reconciliar and cobertura != []:
+                borrados, recuperados = _reconciliar_ids(conn, cliente, pendientes, cobertura)
+                cambios += recuperados
+                _guardar_estado(conn, 'ultima_reconciliacion', _ahora().isoformat())
+            if completa:
+                conn.execute("DELETE FROM sync_estado WHERE clave='cobertura'")
+            if cambios or borrados:
+                actualizar_resumen(conn)
+                _incrementar_version(conn)
+            if futuro_formulario is not None:
+                _guardar_estado(conn, 'version_formulario', futuro_formulario.result()['version'])
+                _guardar_estado(conn, 'version_consultada', _ahora().isoformat())
+            conn.commit()
+            return cambios, borrados
+        finally:
+            conn.close()
+
+
+def cargar_rangos(cliente, rangos):
+    # Carga por período: baja completos, con $filter sobre fecha, los rangos que el espejo todavía no tiene.
+    # Un espejo nuevo arranca en este modo; uno que ya tiene todo el historial no cambia.
+    with _sincronizando():
+        init_db()
+        conn = get_db()
+        try:
+            marca, cobertura = _leer_estado(conn, 'marca_agua'), _leer_cobertura(conn)
+            if cobertura is None and marca:
+                return 0
+            faltantes = _unir_rangos([f for d, h in rangos for f in _rangos_faltantes(cobertura or [], d, h)])
+            if not faltantes:
+                return 0
+            inicio = _ahora() - MARGEN_RELOJ
+            pendientes = _ids_con_cambios_pendientes(conn)
+            remotos, cambios = set(), 0
+            try:
+                for pagina in cliente.paginas_envios({'$filter': _filtro_fechas(faltantes)}, proyectar=proyectar_envio):
+                    remotos.update(r['__id'] for r in pagina)
+                    antes = conn.total_changes
+                    conn.executemany(SQL_UPSERT_ENVIO, [_fila_envio(r) for r in pagina if r['__id'] not in pendientes])
+                    cambios += conn.total_changes - antes
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 400:
+                    raise
+                # El servidor no filtra por fecha: la próxima sincronización baja todo el historial.
+                conn.rollback()
+                conn.execute("DELETE FROM sync_estado WHERE clave IN ('cobertura', 'marca_agua')")
+                conn.commit()
+                return 0
+            # Lo que quedó de esos días de sincronizaciones anteriores y ya no existe en ODK.
+            borrados = _ids_locales(conn, faltantes) - remotos - pendientes
+            conn.executemany('DELETE FROM envios WHERE id=?', [(i,) for i in borrados])
+            _guardar_cobertura(conn, (cobertura or []) + faltantes)
+            if not marca:
+                _guardar_estado(conn, 'marca_agua', inicio.isoformat(timespec='milliseconds').replace('+00:00', 'Z'))
+            if cambios or borrados:
+                actualizar_resumen(conn)
+                _incrementar_version(conn)
+            conn.commit()
+            return cambios + len(borrados)
+        finally:
+            conn.close()
+
+
+def rangos_sin_cargar(desde, hasta):
+    # Partes de [desde, hasta] que el espejo todavía no bajó de ODK; vacío si las tiene todas.
+    init_db()
+    conn = get_db()
+    marca, cobertura = _leer_estado(conn, 'marca_agua'), _leer_cobertura(conn)
+    conn.close()
+    if not marca:
+        return [(desde, hasta)]
+    return [] if cobertura is None else _rangos_faltantes(cobertura, desde, hasta)
+
+
+def actualizar_rango_fechas(cliente):
+    # Primera y última fecha cargadas en ODK, para listar los períodos sin bajar el historial.
+    try:
+        futuro_maximo = cliente.en_segundo_plano(cliente.extremo_envios, 'fecha', descendente=True)
+        minimo, maximo = cliente.extremo_envios('fecha'), futuro_maximo.result()
+    except requests.HTTPError:
+        return
+    init_db()
+    conn = get_db()
+    if minimo and maximo:
+        _guardar_estado(conn, 'fecha_min_remota', minimo[:10])
+        _guardar_estado(conn, 'fecha_max_remota', maximo[:10])
+    conn.commit()
+    conn.close()
+
+
+def _incrementar_version(conn):
+    _guardar_estado(conn, 'version_datos', int(_leer_estado(conn, 'version_datos', 0)) + 1)
+
+
+def instance_id_actual(conn, instance_id):
+    # Central exige como deprecatedID el instanceID de la última versión, no el __id lógico.
+    row = conn.execute("SELECT json_extract(datos, '$.meta.instanceID') AS actual FROM envios WHERE id=?", (instance_id,)).fetchone()
+    return (row['actual'] if row else None) or instance_id
+
+
+def aplicar_cambio_local(conn, operacion, instance_id, datos=None, nuevo_instance_id=None):
+    if operacion == 'eliminar':
+        conn.execute('DELETE FROM envios WHERE id=?', (instance_id,))
+    elif operacion == 'crear':
+        registro = dict(datos, __id=instance_id, meta={'instanceID': instance_id})
+        conn.execute(SQL_UPSERT_ENVIO, _fila_envio(registro))
+    else:
+        conn.execute(
+            "UPDATE envios SET fecha=?, empleado=?, ceco=?, tarea=?, nota=?, horas=?, horas_extra=?, guardia=?, "
+            "datos=json_set(COALESCE(datos, '{}'), '$.meta.instanceID', ?) WHERE id=?",
+            (datos['fecha'], datos['empleado'], datos['ceco'], datos['tarea'], datos['nota'], _a_numero(datos['horas']),
+             _a_numero(datos['horas_extra']), datos['guardia'], nuevo_instance_id, instance_id),
+        )
+    actualizar_resumen(conn)
+    _incrementar_version(conn)
+
+
+def forzar_resincronizacion():
+    # La próxima sincronización vuelve a bajar todo y pisa los cambios optimistas rechazados.
+    # En la carga por período se vacía la cobertura para que cada rango se vuelva a bajar al pedirlo.
+    init_db()
+    conn = get_db()
+    conn.execute("UPDATE sync_estado SET valor='[]' WHERE clave='cobertura'")
+    conn.execute("DELETE FROM sync_estado WHERE clave='marca_agua'")
+    conn.commit()
+    conn.close()
+
+
+def version_formulario():
+    init_db()
+    conn = get_db()
+    version = _leer_estado(conn, 'version_formulario')
+    conn.close()
+    return version
+
+
+def version_datos():
+    init_db()
+    conn = get_db()
+    version = int(_leer_estado(conn, 'version_datos', 0))
+    conn.close()
+    return version
+
+
+def leer_envios_dia(empleado, fecha):
+    init_db()
+    conn = get_db()
+    df = pd.read_sql_query(
+        'SELECT id AS __id, fecha, empleado, ceco, tarea, nota, horas, horas_extra, guardia FROM envios '
+        'WHERE empleado = ? AND date(fecha) = ? ORDER BY rowid', conn, params=(empleado, fecha.isoformat()),
+    )
+    conn.close()
+    return df
+
+
+def leer_resumen(fecha_inicio, fecha_fin, empleado=None):
+    init_db()
+    conn = get_db()
+    sql = 'SELECT empleado, fecha, horas, horas_extra, conteo, tarea, categoria, texto FROM resumen_diario WHERE fecha BETWEEN ? AND ?'
+    params = [fecha_inicio.isoformat(), fecha_fin.isoformat()]
+    if empleado is not None:
+        sql += ' AND empleado = ?'
+        params.append(empleado)
+    df = pd.read_sql_query(sql, conn, params=params, dtype=TIPOS_RESUMEN)
+    conn.close()
+    df['fecha'] = pd.to_datetime(df['fecha'])
+    return df
+
+
+def leer_envios_periodo(fecha_inicio, fecha_fin):
+    # Envíos del período con la categoría del día de resumen_diario; usa idx_envios_fecha, no recorre el resto.
+    init_db()
+    conn = get_db()
+    df = pd.read_sql_query(
+        'SELECT e.empleado, date(e.fecha) AS fecha, e.ceco, e.tarea, e.horas, e.horas_extra, e.guardia, r.categoria '
+        'FROM envios e LEFT JOIN resumen_diario r ON r.empleado = e.empleado AND r.fecha = date(e.fecha) '
+        'WHERE e.fecha >= ? AND e.fecha < ? AND e.empleado IS NOT NULL',
+        conn, params=(fecha_inicio.isoformat(), (fecha_fin + datetime.timedelta(days=1)).isoformat()),
+    )
+    conn.close()
+    return df
+
+
+def versiones_reportes():
+    # {periodo: (versión de los datos, versión del reporte materializado o None)}
+    init_db()
+    conn = get_db()
+    rows = conn.execute(
+        'SELECT p.periodo, p.version, r.version FROM periodo_version p LEFT JOIN reporte_version r ON r.periodo = p.periodo'
+    ).fetchall()
+    conn.close()
+    return {periodo: (datos, reporte) for periodo, datos, reporte in rows}
+
+
+def guardar_reporte(periodo, version, reporte):
+    init_db()
+    conn = get_db()
+    with conn:
+        conn.execute('DELETE FROM reporte_periodo WHERE periodo=?', (periodo,))
+        conn.executemany(
+            f'INSERT INTO reporte_periodo (periodo, {", ".join(reporte.columns)}) VALUES (?{", ?" * len(reporte.columns)})',
+            [(periodo, *fila) for fila in reporte.astype(object).where(reporte.notna(), None).itertuples(index=False)],
+        )
+        conn.execute(
+            'INSERT INTO reporte_version (periodo, version) VALUES (?, ?) ON CONFLICT(periodo) DO UPDATE SET version=excluded.version',
+            (periodo, version),
+        )
+    conn.close()
+
+
+def cursor_reporte(periodo=None):
+    # Quien lo itera cierra la conexión (cursor.connection.close()).
+    init_db()
+    conn = get_db()
+    columnas = 'periodo, empleado, ceco, tarea, horas, horas_extra, dias_guardia, dias_falta, dias_cm, dias_vacaciones, dias_exceso'
+    if periodo:
+        return conn.execute(f'SELECT {columnas} FROM reporte_periodo WHERE periodo=? ORDER BY empleado, ceco, tarea', (periodo,))
+    return conn.execute(f'SELECT {columnas} FROM reporte_periodo ORDER BY periodo, empleado, ceco, tarea')
+
+
+def empleados_con_carga(desde, hasta=None):
+    init_db()
+    conn = get_db()
+    rows = conn.execute(
+        'SELECT DISTINCT empleado FROM resumen_diario WHERE fecha >= ? AND fecha <= ?',
+        (desde.isoformat(), (hasta or datetime.date.max).isoformat()),
+    ).fetchall()
+    conn.close()
+    return {row['empleado'] for row in rows}
+
+
+def opciones_envios():
+    init_db()
+    conn = get_db()
+    cecos = [row[0] for row in conn.execute('SELECT DISTINCT ceco FROM envios WHERE ceco IS NOT NULL ORDER BY ceco')]
+    tareas = [row[0] for row in conn.execute('SELECT DISTINCT tarea FROM envios WHERE tarea IS NOT NULL ORDER BY tarea')]
+    fecha_min, fecha_max = conn.execute('SELECT MIN(fecha), MAX(fecha) FROM resumen_diario').fetchone()
+    # Con carga por período el espejo no tiene todo: se suma el rango informado por ODK.
+    fecha_min = min(filter(None, [fecha_min, _leer_estado(conn, 'fecha_min_remota')]), default=None)
+    fecha_max = max(filter(None, [fecha_max, _leer_estado(conn, 'fecha_max_remota')]), default=None)
+    conn.close()
+    return {
+        'ceco': cecos, 'tarea': tareas,
+        'fecha_min': datetime.date.fromisoformat(fecha_min) if fecha_min else None,
+        'fecha_max': datetime.date.fromisoformat(fecha_max) if fecha_max else None,
+    }
@@ -0,0 +1,129 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+LIMITE_HORAS = 9
+LIMITE_HORAS_VIERNES = 8
+
+# Categorías de celda; el orden de chequeo replica el de la matriz original.
+FALTA, FERIADO, VACACIONES, CM = 'falta', 'feriado', 'vacaciones', 'cm'
+NORMAL, MULTIPLE, EXCESO = 'normal', 'multiple', 'exceso'
+VACIO, VACIO_FINDE = 'vacio', 'vacio_finde'
+TEXTO_CATEGORIA = {FALTA: 'FALTA', FERIADO: 'FERIADO', VACACIONES: 'V', CM: 'CM'}
+TIPO_CATEGORIA = pd.CategoricalDtype([FALTA, FERIADO, VACACIONES, CM, NORMAL, MULTIPLE, EXCESO, VACIO, VACIO_FINDE])
+
+
+def rango_periodo(periodo):
+    año_fin, mes_fin = map(int, periodo.split('-'))
+    fecha_fin = datetime.date(año_fin, mes_fin, 15)
+    fecha_inicio = (fecha_fin.replace(day=1) - datetime.timedelta(days=1)).replace(day=16)
+    return fecha_inicio, fecha_fin
+
+
+def periodo_de_fecha(fecha):
+    # Inversa de rango_periodo: del 16 en adelante la fecha cae en el período del mes siguiente.
+    if fecha.day > 15:
+        fecha = fecha.replace(day=28) + datetime.timedelta(days=4)
+    return f"{fecha.year}-{fecha.month:02d}"
+
+
+def filtrar_periodo(df, fecha_inicio, fecha_fin):
+    fechas = df['fecha']
+    return df[(fechas >= pd.Timestamp(fecha_inicio)) & (fechas < pd.Timestamp(fecha_fin) + pd.Timedelta(days=1))]
+
+
+def _formatear_horas(valores):
+    valores = np.asarray(valores, dtype='float64')
+    enteros = valores == np.trunc(valores)
+    return np.where(enteros, np.trunc(valores).astype('int64').astype(str), np.char.mod('%.1f', valores))
+
+
+def clasificar_tareas(tareas):
+    # Devuelve la categoría especial de cada tarea ('' si es una tarea con horas).
+    texto = tareas.astype(str).str.lower()
+    presente = tareas.notna()
+    return pd.Series(np.select(
+        [
+            presente & (texto.str.strip() == 'falta'),
+            presente & (texto.str.contains('feriado', regex=False) | texto.str.contains('certificado', regex=False)),
+            presente & texto.str.contains('vacaciones', regex=False),
+            presente & texto.str.contains('falta con aviso', regex=False),
+        ],
+        [FALTA, FERIADO, VACACIONES, CM],
+        default='',
+    ), index=tareas.index)
+
+
+def agregar_por_dia(df):
+    dias = df['fecha'].dt.normalize().rename('dia')
+    # Las horas pueden venir en float32; se suman en float64 para no arrastrar error de redondeo al texto.
+    df = df.astype({'horas': 'float64', 'horas_extra': 'float64'})
+    agregado = df.groupby([df['empleado'], dias], sort=False, observed=True).agg(
+        horas=('horas', 'sum'), conteo=('horas', 'count'), horas_extra=('horas_extra', 'sum'), tarea=('tarea', 'first'),
+    )
+    return agregado
+
+
+def celdas_desde_agregado(agregado):
+    # Calcula texto y categoría para cada (empleado, dia) ya agregado, en bloque.
+    horas = agregado['horas'].to_numpy(dtype='float64')
+    extra = agregado['horas_extra'].to_numpy(dtype='float64')
+    conteo = agregado['conteo'].to_numpy(dtype='int64')
+    especial = clasificar_tareas(agregado['tarea']).to_numpy()
+    viernes = agregado.index.get_level_values('dia').weekday.to_numpy() == 4
+
+    texto = _formatear_horas(horas).astype(object)
+    con_extra = extra > 0
+    texto[con_extra] = texto[con_extra] + ' + ' + _formatear_horas(extra[con_extra])
+    multiple = conteo > 1
+    texto[multiple] = texto[multiple] + '(' + conteo[multiple].astype(str) + ')'
+    total = horas + extra
+    exceso = np.where(viernes, total > LIMITE_HORAS_VIERNES, total > LIMITE_HORAS)
+    texto[exceso] = texto[exceso] + '!'
+
+    categoria = np.where(exceso, EXCESO, np.where(multiple, MULTIPLE, NORMAL)).astype(object)
+    hay_especial = especial != ''
+    categoria[hay_especial] = especial[hay_especial]
+    texto[hay_especial] = [TEXTO_CATEGORIA[c] for c in especial[hay_especial]]
+    sin_carga = (conteo == 0) & ~hay_especial
+    texto[sin_carga] = ''
+    categoria[sin_carga] = VACIO
+    return pd.DataFrame({'texto': texto, 'categoria': categoria}, index=agregado.index)
+
+
+def matriz_desde_celdas(celdas, fecha_inicio, fecha_fin):
+    # Matrices empleado x día (columnas datetime.date) con el texto y la categoría de cada celda.
+    dias = pd.date_range(start=fecha_inicio, end=fecha_fin)
+    empleados = sorted(celdas.index.get_level_values('empleado').unique())
+    texto = celdas['texto'].unstack('dia').reindex(index=empleados, columns=dias).fillna('')
+    categoria = celdas['categoria'].unstack('dia').reindex(index=empleados, columns=dias)
+    finde = np.broadcast_to(dias.weekday.to_numpy() >= 5, categoria.shape)
+    vacio = categoria.isna().to_numpy() | (categoria.to_numpy() == VACIO)
+    categoria = categoria.mask(vacio & finde, VACIO_FINDE).mask(vacio & ~finde, VACIO)
+    texto.columns = categoria.columns = [d.date() for d in dias]
+    texto.index.name = categoria.index.name = None
+    return texto, categoria
+
+
+def fila_desde_resumen(resumen, fecha_inicio, fecha_fin):
+    # (día, texto, categoría) de cada día del período con las filas de resumen_diario de un solo empleado.
+    # Equivale a una fila de matriz_desde_celdas sin el costo de armar los DataFrames.
+    celdas = dict(zip(resumen['fecha'], zip(resumen['texto'], resumen['categoria'].astype(object))))
+    fila = []
+    for dia in pd.date_range(start=fecha_inicio, end=fecha_fin):
+        texto, categoria = celdas.get(dia, ('', VACIO))
+        if categoria == VACIO:
+            categoria = VACIO_FINDE if dia.weekday() >= 5 else VACIO
+        fila.append((dia.date(), texto, categoria))
+    return fila
+
+
+def construir_matriz(df_periodo, fecha_inicio, fecha_fin):
+    return matriz_desde_celdas(celdas_desde_agregado(agregar_por_dia(df_periodo)), fecha_inicio, fecha_fin)
+
+
+def construir_matriz_desde_resumen(resumen, fecha_inicio, fecha_fin):
+    # Misma matriz a partir de las filas ya agregadas de resumen_diario.
+    celdas = resumen.rename(columns={'fecha': 'dia'}).set_index(['empleado', 'dia'])[['texto', 'categoria']]
+    return matriz_desde_celdas(celdas, fecha_inicio, fecha_fin)
@@ -0,0 +1,287 @@
+import bisect
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, g, request
+
+BUCKETS_SEGUNDOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_BYTES = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2)
+# Umbral del log de peticiones lentas; 0 lo desactiva.
+LENTO_SEGUNDOS = float(os.environ.get('METRICAS_LENTO_MS', 0)) / 1000
+PROFUNDIDAD_PILA = 15
+STORES_MEDIDOS = ('store-main-data',)
+
+log_lentas = logging.getLogger('metricas.lentas')
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas(nombres, valores, extra=()):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in list(zip(nombres, valores)) + list(extra)]
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+class Contador:
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, etiquetas
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def sumar(self, valor=1, *etiquetas):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def exponer(self):
+        with self._lock:
+            return [f'{self.nombre}{_etiquetas(self.etiquetas, e)} {v}' for e, v in self._valores.items()]
+
+
+class Histograma:
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        self.nombre, self.ayuda, self.etiquetas, self.buckets = nombre, ayuda, etiquetas, buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *etiquetas):
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][bisect.bisect_left(self.buckets, valor)] += 1
+            serie[1] += valor
+
+    def exponer(self):
+        lineas = []
+        with self._lock:
+            for etiquetas, (conteos, suma) in self._series.items():
+                acumulado = 0
+                for limite, conteo in zip(self.buckets + ('+Inf',), conteos):
+                    acumulado += conteo
+                    lineas.append(f'{self.nombre}_bucket{_etiquetas(self.etiquetas, etiquetas, [("le", limite)])} {acumulado}')
+                lineas.append(f'{self.nombre}_sum{_etiquetas(self.etiquetas, etiquetas)} {suma}')
+                lineas.append(f'{self.nombre}_count{_etiquetas(self.etiquetas, etiquetas)} {acumulado}')
+        return lineas
+
+
+REGISTRO = []
+
+
+def _registrar(metrica):
+    REGISTRO.append(metrica)
+    return metrica
+
+
+def _reiniciar_en_hijo():
+    # El fork pudo copiar locks tomados por otros hilos del padre. Lo que mida el hijo no llega al /metrics del padre.
+    for metrica in REGISTRO:
+        metrica._lock = threading.Lock()
+    if _vigia is not None:
+        _vigia._arrancar()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_en_hijo)
+
+
+HTTP = _registrar(Histograma('http_request_duration_seconds', 'Duración de las peticiones HTTP', ('app', 'endpoint', 'method', 'status')))
+DASH_CALLBACK = _registrar(Histograma('dash_callback_duration_seconds', 'Duración de los callbacks de Dash', ('callback',)))
+ODK = _registrar(Histograma('odk_request_duration_seconds', 'Duración de las llamadas a ODK Central', ('method', 'resource', 'status')))
+ODK_JSON = _registrar(Histograma('odk_json_parse_seconds', 'Tiempo de lectura y parseo del cuerpo JSON de las respuestas de ODK'))
+SQLITE = _registrar(Histograma('sqlite_statement_duration_seconds', 'Duración de las sentencias SQLite', ('db', 'statement')))
+MATRIZ = _registrar(Histograma('matriz_build_seconds', 'Tiempo de armado de la matriz de cumplimiento'))
+DASH_STORE = _registrar(Histograma('dash_store_bytes', 'Tamaño de los stores de Dash enviados y recibidos', ('store', 'direction'), BUCKETS_BYTES))
+LENTAS = _registrar(Contador('slow_requests_total', 'Peticiones que superaron METRICAS_LENTO_MS', ('app',)))
+
+
+def exponer():
+    lineas = []
+    for metrica in REGISTRO:
+        lineas += [f'# HELP {metrica.nombre} {metrica.ayuda}', f'# TYPE {metrica.nombre} {metrica.tipo}']
+        lineas += metrica.exponer()
+    return '\n'.join(lineas) + '\n'
+
+
+@contextmanager
+def cronometro(histograma, *etiquetas):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        histograma.observar(time.perf_counter() - inicio, *etiquetas)
+
+
+def cronometrar(histograma, *etiquetas):
+    def decorador(funcion):
+        @wraps(funcion)
+        def medida(*args, **kwargs):
+            with cronometro(histograma, *etiquetas):
+                return funcion(*args, **kwargs)
+        return medida
+    return decorador
+
+
+def callback_medido(registrar):
+    # Reemplazo de dash.callback que mide cada callback registrado con su nombre.
+    def callback(*args, **kwargs):
+        decorador = registrar(*args, **kwargs)
+        return lambda funcion: decorador(cronometrar(DASH_CALLBACK, funcion.__name__)(funcion))
+    return callback
+
+
+def _medir_sql(base, metodo, sql, *args):
+    inicio = time.perf_counter()
+    try:
+        return metodo(sql, *args)
+    finally:
+        sentencia = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+        SQLITE.observar(time.perf_counter() - inicio, base, sentencia)
+
+
+class CursorMedido(sqlite3.Cursor):
+    def execute(self, sql, *args):
+        return _medir_sql(self.connection.nombre_base, super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return _medir_sql(self.connection.nombre_base, super().executemany, sql, *args)
+
+
+class ConexionMedida(sqlite3.Connection):
+    # Factory de sqlite3.connect: mide las sentencias (también las de cursores, como los de pandas.read_sql)
+    # por tipo. No incluye el tiempo de iterar el cursor resultante.
+
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        self.nombre_base = os.path.basename(str(database))
+
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return _medir_sql(self.nombre_base, super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return _medir_sql(self.nombre_base, super().executemany, sql, *args)
+
+    def executescript(self, sql):
+        return _medir_sql(self.nombre_base, super().executescript, sql)
+
+
+class _Vigia:
+    # Hilo que muestrea la pila de las peticiones que pasan el umbral, como un perfilador por muestreo.
+
+    def __init__(self, umbral):
+        self.umbral = umbral
+        self.intervalo = max(umbral / 10, 0.01)
+        self._arrancar()
+
+    def _arrancar(self):
+        # También en el hijo después de un fork: el hilo del padre no se copia y los locks pueden venir tomados.
+        self._activas = {}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._ciclo, daemon=True, name='metricas-vigia').start()
+
+    def iniciar(self, descripcion):
+        with self._lock:
+            self._activas[threading.get_ident()] = (time.perf_counter(), descripcion, Counter())
+
+    def terminar(self):
+        with self._lock:
+            return self._activas.pop(threading.get_ident(), (None, '', Counter()))[1:]
+
+    def _ciclo(self):
+        while True:
+            time.sleep(self.intervalo)
+            ahora = time.perf_counter()
+            marcos = sys._current_frames()
+            with self._lock:
+                activas = list(self._activas.items())
+            # Las pilas se arman fuera del lock para no demorar iniciar/terminar de las peticiones.
+            pilas = []
+            for hilo, activa in activas:
+                if ahora - activa[0] >= self.umbral and hilo in marcos:
+                    pila = traceback.extract_stack(marcos[hilo])[-PROFUNDIDAD_PILA:]
+                    pilas.append((hilo, activa, tuple(f'{f.filename}:{f.lineno} {f.name}' for f in pila)))
+            del marcos
+            with self._lock:
+                for hilo, activa, pila in pilas:
+                    if self._activas.get(hilo) is activa:  # la petición sigue en curso
+                        activa[2][pila] += 1
+
+
+_vigia = None
+
+
+def _obtener_vigia():
+    global _vigia
+    if _vigia is None and LENTO_SEGUNDOS > 0:
+        _vigia = _Vigia(LENTO_SEGUNDOS)
+    return _vigia
+
+
+def _medir_stores(respuesta):
+    cuerpo = request.get_json(silent=True) or {}
+    for entrada in (cuerpo.get('inputs') or []) + (cuerpo.get('state') or []):
+        if isinstance(entrada, dict) and entrada.get('id') in STORES_MEDIDOS:
+            DASH_STORE.observar(len(json.dumps(entrada.get('value'), separators=(',', ':'))), entrada['id'], 'in')
+    salidas = [s for s in STORES_MEDIDOS if s in str(cuerpo.get('output', ''))]
+    if salidas and respuesta.status_code == 200 and not respuesta.headers.get('Content-Encoding'):
+        datos = json.loads(respuesta.get_data()).get('response', {})
+        for store in salidas:
+            if store in datos:
+                DASH_STORE.observar(len(json.dumps(datos[store], separators=(',', ':'))), store, 'out')
+
+
+def instrumentar_flask(app, nombre):
+    # Mide todas las rutas de la app, expone /metrics y, con METRICAS_LENTO_MS, loguea las peticiones
+    # lentas con las pilas más muestreadas mientras estaban en curso.
+    vigia = _obtener_vigia()
+
+    @app.before_request
+    def _inicio():
+        g.metricas_inicio = time.perf_counter()
+        if vigia:
+            salida = (request.get_json(silent=True) or {}).get('output') if request.path.endswith('_dash-update-component') else None
+            vigia.iniciar(f'{request.method} {request.full_path}' + (f' -> {salida}' if salida else ''))
+
+    @app.after_request
+    def _fin(respuesta):
+        inicio = g.pop('metricas_inicio', None)
+        if inicio is None:
+            return respuesta
+        duracion = time.perf_counter() - inicio
+        endpoint = request.url_rule.rule if request.url_rule else 'sin_ruta'
+        HTTP.observar(duracion, nombre, endpoint, request.method, respuesta.status_code)
+        if request.path.endswith('_dash-update-component'):
+            _medir_stores(respuesta)
+        if vigia:
+            descripcion, muestras = vigia.terminar()
+            if duracion >= vigia.umbral:
+                LENTAS.sumar(1, nombre)
+                perfil = ''.join(
+                    f'\n  {n} muestra(s):\n    ' + '\n    '.join(pila) for pila, n in muestras.most_common(3)
+                )
+                log_lentas.warning('%s %s tardó %.0f ms%s', nombre, descripcion, duracion * 1000, perfil)
+        return respuesta
+
+    @app.teardown_request
+    def _limpiar(_error):
+        if vigia:
+            vigia.terminar()
+
+    app.add_url_rule('/metrics', 'metricas', lambda: Response(exponer(), content_type='text/plain; version=0.0.4; charset=utf-8'))
+    return app
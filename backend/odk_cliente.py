@@ -0,0 +1,239 @@
+import codecs
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metricas
+
+TIMEOUT = (5, 60)
+REINTENTOS = 4
+BACKOFF = 0.5
+TAMANIO_PAGINA = 1000
+MAX_HILOS = 4
+TAMANIO_BLOQUE = 64 * 1024
+
+_pool = ThreadPoolExecutor(max_workers=MAX_HILOS, thread_name_prefix='odk')
+_sesiones = threading.local()
+
+
+def _reiniciar_en_hijo():
+    # Un proceso hijo (callbacks en segundo plano de Dash) hereda el pool sin sus hilos y las conexiones
+    # abiertas del padre: arranca con los suyos.
+    global _pool, _sesiones
+    _pool = ThreadPoolExecutor(max_workers=MAX_HILOS, thread_name_prefix='odk')
+    _sesiones = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_en_hijo)
+
+
+def _nueva_sesion(reintentos, backoff):
+    # POST y PUT no se reintentan ante respuestas del servidor: un 502 del proxy puede llegar con el cambio ya
+    # aplicado, y repetido volvería como 409 (alta duplicada, o deprecatedID que ya no es el vigente).
+    # Los errores de conexión sí, porque en ese caso la petición nunca llegó.
+    retry = Retry(
+        total=reintentos, connect=reintentos, read=reintentos, status=reintentos, backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset(['GET', 'HEAD', 'DELETE']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_HILOS * 2, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _sesion(reintentos, backoff):
+    # Una sesión keep-alive por hilo: requests.Session no garantiza ser thread-safe.
+    clave = (reintentos, backoff)
+    sesiones = getattr(_sesiones, 'por_config', None)
+    if sesiones is None:
+        sesiones = _sesiones.por_config = {}
+    if clave not in sesiones:
+        sesiones[clave] = _nueva_sesion(reintentos, backoff)
+    return sesiones[clave]
+
+
+class _LectorJSON:
+    # Lee un JSON desde el cuerpo de una respuesta a medida que llega, valor por valor.
+
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, response):
+        self._bloques = response.iter_content(TAMANIO_BLOQUE)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.texto, self.pos, self.agotado = '', 0, False
+
+    def _leer_mas(self):
+        if self.agotado:
+            raise ValueError('JSON incompleto en la respuesta de ODK')
+        bloque = next(self._bloques, None)
+        self.agotado = bloque is None
+        self.texto = self.texto[self.pos:] + self._utf8.decode(bloque or b'', final=self.agotado)
+        self.pos = 0
+
+    def simbolo(self):
+        while True:
+            while self.pos < len(self.texto) and self.texto[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.texto):
+                return self.texto[self.pos]
+            self._leer_mas()
+
+    def consumir(self, esperado):
+        if self.simbolo() != esperado:
+            raise ValueError(f"se esperaba '{esperado}' en la respuesta de ODK")
+        self.pos += 1
+
+    def valor(self):
+        self.simbolo()
+        while True:
+            try:
+                valor, fin = self._decoder.raw_decode(self.texto, self.pos)
+                # Un número al final del bloque puede seguir en el próximo.
+                if fin < len(self.texto) or self.agotado:
+                    self.pos = fin
+                    return valor
+            except json.JSONDecodeError:
+                if self.agotado:
+                    raise
+            self._leer_mas()
+
+
+def leer_odata(response, proyectar=None):
+    # Cada elemento de "value" se decodifica y proyecta por separado, así el documento completo
+    # nunca está en memoria, ni como texto ni como dicts.
+    lector, cuerpo, valores = _LectorJSON(response), {}, []
+    lector.consumir('{')
+    while lector.simbolo() != '}':
+        clave = lector.valor()
+        lector.consumir(':')
+        if clave == 'value':
+            lector.consumir('[')
+            while lector.simbolo() != ']':
+                registro = lector.valor()
+                valores.append(proyectar(registro) if proyectar else registro)
+                if lector.simbolo() == ',':
+                    lector.consumir(',')
+            lector.consumir(']')
+        else:
+            cuerpo[clave] = lector.valor()
+        if lector.simbolo() == ',':
+            lector.consumir(',')
+    cuerpo['value'] = valores
+    return cuerpo
+
+
+def xml_envio(form_id, version_formulario, datos, instance_id, deprecated_id=None):
+    meta_xml = f"<instanceID>{escape(instance_id)}</instanceID>"
+    if deprecated_id:
+        meta_xml = f"<deprecatedID>{escape(deprecated_id)}</deprecatedID>{meta_xml}"
+    campos = ''.join(
+        f"<{campo}>{escape(str(datos[campo]))}</{campo}>"
+        for campo in ('fecha', 'empleado', 'ceco', 'tarea', 'nota', 'horas', 'horas_extra', 'guardia')
+    )
+    return f'<data id="{escape(form_id)}" version="{escape(str(version_formulario))}">{campos}<meta>{meta_xml}</meta></data>'
+
+
+class ClienteODK:
+    def __init__(self, base_url, form_id, token, project_id=1, timeout=TIMEOUT, reintentos=REINTENTOS, backoff=BACKOFF):
+        self.base_url = base_url
+        self.form_id = form_id
+        self.token = token
+        self.project_id = project_id
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.backoff = backoff
+
+    @property
+    def url_formulario(self):
+        return f"{self.base_url}/projects/{self.project_id}/forms/{self.form_id}"
+
+    @property
+    def url_odata(self):
+        return f"{self.url_formulario}.svc/Submissions"
+
+    def _request(self, metodo, url, **kwargs):
+        headers = {'Authorization': f'Bearer {self.token}', **kwargs.pop('headers', {})}
+        inicio, estado = time.perf_counter(), 'error'
+        try:
+            response = _sesion(self.reintentos, self.backoff).request(metodo, url, headers=headers, timeout=self.timeout, **kwargs)
+            estado = response.status_code
+            return response
+        finally:
+            recurso = 'odata' if '.svc/' in url else ('submissions' if '/submissions' in url else 'form')
+            metricas.ODK.observar(time.perf_counter() - inicio, metodo, recurso, estado)
+
+    def _get_json(self, url, params=None):
+        response = self._request('GET', url, params=params)
+        response.raise_for_status()
+        with metricas.cronometro(metricas.ODK_JSON):
+            return response.json()
+
+    def _get_odata(self, url, params=None, proyectar=None):
+        response = self._request('GET', url, params=params, stream=True)
+        try:
+            response.raise_for_status()
+            with metricas.cronometro(metricas.ODK_JSON):
+                return leer_odata(response, proyectar)
+        finally:
+            response.close()
+
+    def en_segundo_plano(self, funcion, *args, **kwargs):
+        return _pool.submit(funcion, *args, **kwargs)
+
+    def obtener_formulario(self):
+        return self._get_json(self.url_formulario)
+
+    def contar_envios(self, params=None):
+        cuerpo = self._get_json(self.url_odata, dict(params or {}, **{'$top': 0, '$count': 'true'}))
+        return cuerpo.get('@odata.count')
+
+    def extremo_envios(self, campo, descendente=False):
+        params = {'$orderby': f"{campo} {'desc' if descendente else 'asc'}", '$top': 1, '$select': campo}
+        valores = self._get_json(self.url_odata, params).get('value', [])
+        return valores[0].get(campo) if valores else None
+
+    def paginas_envios(self, params=None, tamanio=TAMANIO_PAGINA, proyectar=None):
+        # Sigue @odata.nextLink página por página. El $skiptoken de Central continúa después del último envío
+        # entregado: altas o bajas durante el paginado no corren las páginas siguientes, como pasaría con $skip.
+        # Mientras el que llama procesa una página se baja solo la siguiente: nunca hay más de dos en memoria.
+        # proyectar se aplica a cada envío mientras se parsea la respuesta.
+        cuerpo = self._get_odata(self.url_odata, dict(params or {}, **{'$top': tamanio}), proyectar)
+        futuro = None
+        try:
+            while True:
+                siguiente = cuerpo.get('@odata.nextLink')
+                futuro = _pool.submit(self._get_odata, siguiente, proyectar=proyectar) if siguiente else None
+                yield cuerpo.pop('value', [])
+                if futuro is None:
+                    return
+                cuerpo = futuro.result()
+        finally:
+            if futuro is not None:
+                futuro.cancel()
+
+    def instance_id_vigente(self, instance_id):
+        # meta/instanceID de la versión actual del envío, o None si ya no existe.
+        cuerpo = self._get_odata(self.url_odata, {'$filter': f"__id eq '{instance_id}'"},
+                                 proyectar=lambda r: (r.get('meta') or {}).get('instanceID'))
+        return next(iter(cuerpo.get('value', [])), None)
+
+    def crear_envio(self, xml):
+        return self._request('POST', f"{self.url_formulario}/submissions", data=xml.encode('utf-8'),
+                             headers={'Content-Type': 'application/xml;charset=UTF-8'})
+
+    def editar_envio(self, instance_id, xml):
+        return self._request('PUT', f"{self.url_formulario}/submissions/{instance_id}", data=xml.encode('utf-8'),
+                             headers={'Content-Type': 'application/xml;charset=UTF-8'})
+
+    def eliminar_envio(self, instance_id):
+        return self._request('DELETE', f"{self.url_formulario}/submissions/{instance_id}")
@@ -0,0 +1,192 @@
+import csv
+import io
+import re
+import secrets
+import tempfile
+import threading
+import time
+
+import requests
+from flask import Response, abort, request
+
+import espejo_odk
+import matriz
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+COLUMNAS = [
+    'periodo', 'empleado', 'ceco', 'tarea', 'horas', 'horas_extra',
+    'dias_guardia', 'dias_falta', 'dias_cm', 'dias_vacaciones', 'dias_exceso',
+]
+# Días del empleado en ese ceco/tarea que tienen cada categoría de la matriz.
+DIAS_POR_CATEGORIA = {
+    'dias_falta': matriz.FALTA, 'dias_cm': matriz.CM, 'dias_vacaciones': matriz.VACACIONES, 'dias_exceso': matriz.EXCESO,
+}
+TAMANIO_LOTE = 1000
+TAMANIO_BLOQUE = 64 * 1024
+PATRON_PERIODO = re.compile(r'\d{4}-\d{2}')
+VIGENCIA_PASE = 30 * 60
+
+_lock = threading.Lock()
+
+
+def resumen_periodo(envios):
+    # Totales por empleado x ceco x tarea de los envíos de un período (ver espejo_odk.leer_envios_periodo).
+    # Un día con varias tareas cuenta en cada una: los días no se suman entre filas del mismo empleado.
+    dia = envios['fecha']
+    dias = {'dias_guardia': dia.where(envios['guardia'].str.lower().eq('si'))}
+    dias.update({columna: dia.where(envios['categoria'].eq(categoria)) for columna, categoria in DIAS_POR_CATEGORIA.items()})
+    grupos = envios.assign(**dias).groupby(['empleado', 'ceco', 'tarea'], dropna=False, sort=True)
+    reporte = grupos.agg(
+        horas=('horas', 'sum'), horas_extra=('horas_extra', 'sum'), **{columna: (columna, 'nunique') for columna in dias},
+    )
+    return reporte.reset_index()
+
+
+def materializar(periodo, versiones=None):
+    # Recalcula el reporte del período solo si sus envíos cambiaron desde la última vez.
+    with _lock:
+        versiones = versiones or espejo_odk.versiones_reportes()
+        version, materializada = versiones.get(periodo, (None, None))
+        # Un período sin periodo_version no tiene envíos en el espejo: no hay nada que materializar.
+        if version is None or materializada == version:
+            return False
+        fecha_inicio, fecha_fin = matriz.rango_periodo(periodo)
+        espejo_odk.guardar_reporte(periodo, version, resumen_periodo(espejo_odk.leer_envios_periodo(fecha_inicio, fecha_fin)))
+        return True
+
+
+def materializar_todos():
+    versiones = espejo_odk.versiones_reportes()
+    return sum(materializar(periodo, versiones) for periodo in sorted(versiones))
+
+
+def _lotes(periodo):
+    cursor = espejo_odk.cursor_reporte(periodo)
+    try:
+        while True:
+            lote = cursor.fetchmany(TAMANIO_LOTE)
+            if not lote:
+                break
+            yield lote
+    finally:
+        cursor.connection.close()
+
+
+def exportar_csv(periodo=None):
+    yield ','.join(COLUMNAS) + '\r\n'
+    for lote in _lotes(periodo):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(tuple(fila) for fila in lote)
+        yield buffer.getvalue()
+
+
+def exportar_xlsx(periodo=None):
+    # openpyxl arma el zip al cerrar el libro: se escribe en modo streaming a un temporal y se envía por bloques.
+    libro = openpyxl.Workbook(write_only=True)
+    hoja = libro.create_sheet(periodo or 'reportes')
+    hoja.append(COLUMNAS)
+    for lote in _lotes(periodo):
+        for fila in lote:
+            hoja.append(tuple(fila))
+    with tempfile.TemporaryFile() as archivo:
+        libro.save(archivo)
+        archivo.seek(0)
+        while True:
+            bloque = archivo.read(TAMANIO_BLOQUE)
+            if not bloque:
+                break
+            yield bloque
+
+
+class PasesDescarga:
+    # Los enlaces de descarga llevan un pase emitido para la sesión en lugar del token de ODK. El token queda
+    # del lado del servidor (en diskcache si está, así lo ven todos los procesos) hasta que el pase vence.
+
+    def __init__(self, cache=None, vigencia=VIGENCIA_PASE):
+        self.cache = cache
+        self.vigencia = vigencia
+        self._lock = threading.Lock()
+        self._pases = {}
+
+    def emitir(self, token):
+        pase = secrets.token_urlsafe(24)
+        if self.cache is not None:
+            self.cache.set(f'pase-descarga:{pase}', token, expire=self.vigencia)
+            return pase
+        with self._lock:
+            ahora = time.monotonic()
+            self._pases = {p: v for p, v in self._pases.items() if v[0] > ahora}
+            self._pases[pase] = (ahora + self.vigencia, token)
+        return pase
+
+    def token(self, pase):
+        if not pase:
+            return None
+        if self.cache is not None:
+            return self.cache.get(f'pase-descarga:{pase}')
+        with self._lock:
+            vence, token = self._pases.get(pase, (0, None))
+        return token if vence > time.monotonic() else None
+
+
+def _token_de_peticion(pases):
+    # El pase del enlace del dashboard, o el token de ODK en Authorization para descargas desde scripts.
+    autorizacion = request.headers.get('Authorization', '')
+    if autorizacion.startswith('Bearer '):
+        return autorizacion[len('Bearer '):].strip() or None
+    return pases.token(request.args.get('pase'))
+
+
+def completar_espejo(cliente, periodo=None):
+    # Con carga por período el espejo solo tiene lo que alguien miró: antes de exportar se baja lo que falte
+    # del período (o de todo el historial) y los cambios desde la última sincronización. Devuelve los
+    # rangos que siguen sin estar en el espejo; vacío si el reporte va a estar completo.
+    if periodo is None:
+        espejo_odk.actualizar_rango_fechas(cliente)
+        opciones = espejo_odk.opciones_envios()
+        rangos = [(opciones['fecha_min'], opciones['fecha_max'])] if opciones['fecha_min'] else []
+    else:
+        rangos = [matriz.rango_periodo(periodo)]
+    espejo_odk.cargar_rangos(cliente, rangos)
+    espejo_odk.sincronizar_envios(cliente)
+    return [faltante for desde, hasta in rangos for faltante in espejo_odk.rangos_sin_cargar(desde, hasta)]
+
+
+def registrar_rutas(server, cliente_odk, pases):
+    # /reportes/<período>.csv|.xlsx, o /reportes/todos.csv|.xlsx con todos los períodos de ODK. Piden el token
+    # de la sesión (ver PasesDescarga) y con él completan el espejo antes de materializar y exportar.
+    @server.route('/reportes/<periodo>.<formato>')
+    def descargar_reporte(periodo, formato):
+        if formato not in ('csv', 'xlsx') or (periodo != 'todos' and not PATRON_PERIODO.fullmatch(periodo)):
+            abort(404)
+        if formato == 'xlsx' and openpyxl is None:
+            return Response('La exportación a XLSX requiere openpyxl.', status=501, mimetype='text/plain')
+        token = _token_de_peticion(pases)
+        if not token:
+            return Response('Se requiere una sesión de ODK.', status=401, mimetype='text/plain')
+        periodo = None if periodo == 'todos' else periodo
+        try:
+            faltantes = completar_espejo(cliente_odk(token), periodo)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code in (401, 403):
+                return Response('ODK rechazó el token de la sesión.', status=401, mimetype='text/plain')
+            return Response(f'No se pudieron bajar de ODK los envíos del reporte: {e}', status=502, mimetype='text/plain')
+        except requests.RequestException as e:
+            return Response(f'No se pudieron bajar de ODK los envíos del reporte: {e}', status=502, mimetype='text/plain')
+        if faltantes:
+            return Response('El espejo no tiene todos los envíos del reporte; intente de nuevo.', status=503, mimetype='text/plain')
+        if periodo is None:
+            materializar_todos()
+        else:
+            materializar(periodo)
+        generar = exportar_csv if formato == 'csv' else exportar_xlsx
+        mimetype = 'text/csv' if formato == 'csv' else 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        return Response(generar(periodo), mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename=reporte_{periodo or "todos"}.{formato}',
+        })
+
+    return server
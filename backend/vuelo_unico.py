@@ -0,0 +1,74 @@
+import threading
+import time
+from concurrent.futures import Future
+
+FRESCURA_SEGUNDOS = 10
+# Si quien ejecuta muere con el candado de diskcache tomado, los demás lo recuperan pasado este tiempo.
+EXPIRACION_CANDADO = 10 * 60
+ETIQUETA = 'vuelo-unico'
+
+
+class VueloUnico:
+    # Las llamadas concurrentes con la misma clave comparten una sola ejecución y su resultado, que además
+    # se reutiliza durante `frescura` segundos. Con un diskcache.Cache la coordinación vale entre procesos
+    # (los callbacks en segundo plano de Dash corren cada uno en el suyo); sin él, entre hilos.
+
+    def __init__(self, frescura=FRESCURA_SEGUNDOS, cache=None):
+        self.frescura = frescura
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._en_vuelo = {}
+        self._recientes = {}
+
+    def ejecutar(self, clave, funcion):
+        if self.cache is not None:
+            return self._ejecutar_en_cache(clave, funcion)
+        with self._lock:
+            reciente = self._recientes.get(clave)
+            if reciente and time.monotonic() - reciente[0] < self.frescura:
+                return reciente[1]
+            futuro = self._en_vuelo.get(clave)
+            propio = futuro is None
+            if propio:
+                futuro = self._en_vuelo[clave] = Future()
+        if not propio:
+            return futuro.result()
+        try:
+            resultado = funcion()
+        except BaseException as e:
+            with self._lock:
+                del self._en_vuelo[clave]
+            futuro.set_exception(e)
+            raise
+        with self._lock:
+            del self._en_vuelo[clave]
+            self._recientes[clave] = (time.monotonic(), resultado)
+        futuro.set_result(resultado)
+        return resultado
+
+    def _ejecutar_en_cache(self, clave, funcion):
+        import diskcache
+
+        clave = f'{ETIQUETA}:{clave}'
+        encontrado, resultado = self._leer(clave)
+        if encontrado:
+            return resultado
+        with diskcache.Lock(self.cache, f'{clave}:candado', expire=EXPIRACION_CANDADO):
+            # Quien tenía el candado pudo haber terminado mientras esperábamos.
+            encontrado, resultado = self._leer(clave)
+            if encontrado:
+                return resultado
+            resultado = funcion()
+            self.cache.set(clave, resultado, expire=self.frescura, tag=ETIQUETA)
+            return resultado
+
+    def _leer(self, clave):
+        resultado = self.cache.get(clave, default=self)
+        return resultado is not self, resultado
+
+    def olvidar(self):
+        # Descarta los resultados recientes: la próxima llamada vuelve a ejecutar.
+        if self.cache is not None:
+            self.cache.evict(ETIQUETA)
+        with self._lock:
+            self._recientes.clear()
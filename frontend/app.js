@@ -6,14 +6,61 @@ document.addEventListener('DOMContentLoaded', () => {
     }).addTo(map);
 
     let selected = null;
+    let selectedLote = null;
     let marker = null;
 
-    map.on('click', (e) => {
-        selected = e.latlng;
+    // Lots in the current view, with the number of irrigations in the last VENTANA_DIAS days.
+    const VENTANA_DIAS = 30;
+    const capaLotes = L.layerGroup().addTo(map);
+    let pedidoLotes = null;
+    let esperaLotes = null;
+
+    function colorLote(ultimoRiego) {
+        const dias = (Date.now() - new Date(ultimoRiego)) / 86400000;
+        return dias <= 7 ? '#198754' : dias <= VENTANA_DIAS ? '#fd7e14' : '#dc3545';
+    }
+
+    function loadLotes() {
+        if (pedidoLotes) pedidoLotes.abort();
+        pedidoLotes = new AbortController();
+        const desde = new Date(Date.now() - VENTANA_DIAS * 86400000).toISOString().slice(0, 10);
+        const params = new URLSearchParams({ bbox: map.getBounds().toBBoxString(), zoom: map.getZoom(), desde });
+        fetch(`/api/lotes?${params}`, { signal: pedidoLotes.signal })
+            .then(r => r.json())
+            .then(data => {
+                capaLotes.clearLayers();
+                data.clusters.forEach(c => {
+                    L.circleMarker([c.lat, c.lng], { radius: 8 + Math.min(Math.log2(c.lotes) * 3, 20), color: '#0d6efd' })
+                        .bindTooltip(`${c.lotes} lotes, ${c.riegos} riegos en ${VENTANA_DIAS} días`)
+                        .on('click', e => { L.DomEvent.stop(e); map.setView([c.lat, c.lng], map.getZoom() + 2); })
+                        .addTo(capaLotes);
+                });
+                data.lotes.forEach(l => {
+                    L.circleMarker([l.lat, l.lng], { radius: 6, color: colorLote(l.ultimo_riego), bubblingMouseEvents: false })
+                        .bindPopup(`Último riego: ${l.ultimo_riego}<br>${l.riegos} riegos en ${VENTANA_DIAS} días`)
+                        .on('click', () => seleccionar(L.latLng(l.lat, l.lng), l.lote))
+                        .addTo(capaLotes);
+                });
+            })
+            .catch(e => { if (e.name !== 'AbortError') throw e; });
+    }
+
+    map.on('moveend', () => {
+        clearTimeout(esperaLotes);
+        esperaLotes = setTimeout(loadLotes, 200);
+    });
+    loadLotes();
+
+    // Clicking an existing lot reuses its exact lote string so its irrigations stay grouped.
+    function seleccionar(latlng, lote = `${latlng.lat},${latlng.lng}`) {
+        selected = latlng;
+        selectedLote = lote;
         document.getElementById('lote-display').textContent = `${selected.lat.toFixed(5)}, ${selected.lng.toFixed(5)}`;
         if (marker) marker.remove();
         marker = L.marker(selected).addTo(map);
-    });
+    }
+
+    map.on('click', (e) => seleccionar(e.latlng));
 
     const fechaInput = document.getElementById('fecha');
     document.getElementById('guardar').addEventListener('click', () => {
@@ -25,7 +72,7 @@ document.addEventListener('DOMContentLoaded', () => {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
-                lote: `${selected.lat},${selected.lng}`,
+                lote: selectedLote,
                 fecha: fechaInput.value,
                 nota: ''
             })
@@ -34,20 +81,31 @@ document.addEventListener('DOMContentLoaded', () => {
         .then(() => {
             fechaInput.value = '';
             loadRiegos();
+            loadLotes();
         });
     });
 
-    function loadRiegos() {
-        fetch('/api/riegos')
+    let nextCursor = null;
+    const masBtn = document.getElementById('cargar-mas');
+    masBtn.addEventListener('click', () => loadRiegos(nextCursor));
+
+    function loadRiegos(cursor = null) {
+        const params = new URLSearchParams({ limit: '100' });
+        if (cursor) params.set('cursor', cursor);
+        fetch(`/api/riegos?${params}`)
             .then(r => r.json())
             .then(data => {
                 const tbody = document.querySelector('#tabla-riegos tbody');
-                tbody.innerHTML = '';
-                data.forEach(riego => {
+                if (!cursor) tbody.innerHTML = '';
+                const filas = document.createDocumentFragment();
+                data.riegos.forEach(riego => {
                     const tr = document.createElement('tr');
                     tr.innerHTML = `<td>${riego.id}</td><td>${riego.lote}</td><td>${riego.fecha}</td><td>${riego.nota}</td>`;
-                    tbody.appendChild(tr);
+                    filas.appendChild(tr);
                 });
+                tbody.appendChild(filas);
+                nextCursor = data.next_cursor;
+                masBtn.hidden = !nextCursor;
             });
     }
 